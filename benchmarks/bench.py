@@ -0,0 +1,329 @@
+"""Pysole benchmark suite.
+
+Times the hot paths of the console, headless and with no fps limit, and writes
+the results as JSON. Results can be saved as a baseline and later runs compared
+against it, the script exits with a non zero status if any benchmark got slower
+than the baseline by more than the tolerance.
+
+Example:
+    $ python3 benchmarks/bench.py --save-baseline
+    $ python3 benchmarks/bench.py --compare
+
+Note:
+    Timings depend on the machine, so baselines should only be compared with
+    runs on the same machine.
+
+"""
+
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from functools import partial
+from time import perf_counter, process_time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# Keep pygame's import message out of the JSON on stdout
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame
+
+from pysole.console import Console
+from pysole.record import trace_config
+from pysole.remote import RemoteClient
+from pysole.scrollback import Scrollback
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Run in a fresh interpreter, prints the seconds from the start of the import
+# until pygame is imported, pysole.console is imported and the first frame is presented
+STARTUP_SCRIPT = '''
+import sys
+from time import perf_counter
+start = perf_counter()
+import pygame
+pygame_imported = perf_counter()
+from pysole.console import Console
+imported = perf_counter()
+Console({'font': sys.argv[1], 'headless': True, 'fps': 0})
+print(pygame_imported - start, imported - start, perf_counter() - start)
+'''
+
+
+def default_font():
+    return os.path.join(os.path.dirname(pygame.__file__), pygame.font.get_default_font())
+
+
+def new_console(font, **config):
+    settings = {'font': font, 'headless': True, 'fps': 0}
+    settings.update(config)
+    return Console(settings)
+
+
+def bench_startup(font, n):
+    start = perf_counter()
+    for _ in range(n):
+        new_console(font)
+    return perf_counter() - start
+
+
+def startup_phases(font):
+    env = dict(os.environ, PYTHONPATH=ROOT, PYGAME_HIDE_SUPPORT_PROMPT='1')
+    output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, font], env=env,
+                            stdout=subprocess.PIPE, check=True).stdout
+    return [float(seconds) for seconds in output.split()]
+
+
+def bench_cold_start(font, n, phase=2):
+    # Start a new interpreter, import pysole.console and present the first frame,
+    # timing up to the end of the given phase of startup_phases
+    return sum(startup_phases(font)[phase] for _ in range(n))
+
+
+def bench_write_line(font, n):
+    console = new_console(font)
+    start = perf_counter()
+    for i in range(n):
+        console.write_line('Benchmark line ' + str(i))
+    return perf_counter() - start
+
+
+def bench_write_fragments(font, n):
+    console = new_console(font)
+    start = perf_counter()
+    for i in range(n):
+        console.write('ab')
+        if i % 40 == 39:
+            console.write_line()
+    return perf_counter() - start
+
+
+def bench_scroll_past_cutoff(font, n):
+    # Fill the scrollback first so every timed line scrolls and drops the oldest line
+    console = new_console(font, line_cutoff=n, buffered=True, auto_present=False)
+    for i in range(n):
+        console.write_line('Filler line ' + str(i))
+    console.buffered = False
+    start = perf_counter()
+    for i in range(n):
+        console.write_line('Scrolled line ' + str(i))
+    return perf_counter() - start
+
+
+def bench_trim(font, n):
+    lines = Scrollback(100000)
+    for _ in range(lines.capacity):
+        lines.append()
+    start = perf_counter()
+    for _ in range(n):
+        lines.append()
+    return perf_counter() - start
+
+
+def bench_read_line_echo(font, n):
+    # Buffered so each echoed key is drawn by read_line's next frame instead of its own
+    console = new_console(font, buffered=True, auto_present=False)
+    display = console._display
+    keys = [pygame.event.Event(pygame.KEYDOWN, key=pygame.K_a, unicode='a', mod=0) for _ in range(n)]
+    keys.append(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_RETURN, unicode='\r', mod=0))
+    keys.reverse()
+    step = display.step
+
+    def step_with_key(wait=True, idle=None):
+        # Simulate one key press arriving per frame
+        if keys:
+            pygame.event.post(keys.pop())
+        step(wait, idle)
+
+    display.step = step_with_key
+    start = perf_counter()
+    console.read_line('> ')
+    return perf_counter() - start
+
+
+def bench_read_line_typeahead(font, n):
+    # Every key is pressed before read_line starts, as when pasting or typing ahead
+    console = new_console(font)
+    for _ in range(n):
+        pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_a, unicode='a', mod=0))
+    pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_RETURN, unicode='\r', mod=0))
+    start = perf_counter()
+    if len(console.read_line('> ')) != n:
+        raise RuntimeError('read_line lost key presses')
+    return perf_counter() - start
+
+
+def bench_idle(font, n):
+    # CPU time, not wall time, spent sleeping n ms in a window with nothing to draw
+    console = new_console(font, fps=60)
+    start = process_time()
+    console.sleep(n)
+    return process_time() - start
+
+
+def bench_progress(font, n):
+    # Redraw a progress line in place under a screen of output, each update presenting a frame
+    console = new_console(font)
+    for i in range(100):
+        console.write_line('Output line ' + str(i))
+    start = perf_counter()
+    for i in range(n):
+        console.write('\rProgress ' + str(i * 100 // n) + '% ' + '#' * (i * 40 // n))
+    return perf_counter() - start
+
+
+def bench_remote_progress(font, n):
+    # The progress benchmark with a client watching, each update is sent as the one changed line
+    address = 'unix:' + os.path.join(tempfile.mkdtemp(), 'console.sock')
+    console = new_console(font, remote=address)
+    client = RemoteClient(address)
+    while not client.wait(0.001):
+        console.sleep(1)
+    for i in range(100):
+        console.write_line('Output line ' + str(i))
+    start = perf_counter()
+    for i in range(n):
+        console.write('\rProgress ' + str(i * 100 // n) + '% ' + '#' * (i * 40 // n))
+    elapsed = perf_counter() - start
+    client.close()
+    console._remote.close()
+    return elapsed
+
+
+def bench_theme_swap(font, n, palette=False):
+    # Swap between two themes with a screen of text in several colours
+    console = new_console(font, palette_text=palette, buffered=True, auto_present=False)
+    colours = [(255, 255, 255), (255, 0, 0), (0, 255, 0), (0, 128, 255)]
+    for i in range(200):
+        console.foreground_colour = colours[i % len(colours)]
+        console.write_line('Themed line ' + str(i) + ' with some text')
+    console.present()
+    themes = [{'white': 'black', 'black': 'white', 'red': 'dark_red'}, None]
+    start = perf_counter()
+    for i in range(n):
+        console.set_theme(themes[i % 2])
+        console.present()
+    return perf_counter() - start
+
+
+def bench_replay(font, n):
+    # Record a session of coloured, ANSI and read_line output, then replay it as fast as possible
+    path = os.path.join(tempfile.mkdtemp(), 'session.trace')
+    console = new_console(font, record_file=path, buffered=True)
+    for i in range(n):
+        console.foreground_colour = (255, 255, 255) if i % 4 else (255, 0, 0)
+        console.write_line('Session line ' + str(i))
+        if i % 10 == 9:
+            console.write_ansi('\x1b[32mok\x1b[0m ' + str(i) + '\n')
+        if i % 100 == 99:
+            for key in 'yes\r':
+                pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=ord(key), unicode=key, mod=0))
+            console.read_line('Continue? ')
+    console._recorder.close()
+    return bench_trace(path, font, n)
+
+
+def bench_trace(path, font, n):
+    config = trace_config(path)
+    config.update(headless=True, fps=0)
+    console = Console(config)
+    start = perf_counter()
+    console.replay(path, speed=0)
+    return perf_counter() - start
+
+
+BENCHMARKS = [('startup', bench_startup, 20),
+              ('import_pygame', partial(bench_cold_start, phase=0), 5),
+              ('import', partial(bench_cold_start, phase=1), 5),
+              ('cold_start', bench_cold_start, 5),
+              ('write_line', bench_write_line, 2000),
+              ('write_fragments', bench_write_fragments, 2000),
+              ('scroll_past_cutoff', bench_scroll_past_cutoff, 2000),
+              ('trim', bench_trim, 100000),
+              ('read_line_echo', bench_read_line_echo, 500),
+              ('read_line_typeahead', bench_read_line_typeahead, 500),
+              ('idle', bench_idle, 1000),
+              ('replay', bench_replay, 2000),
+              ('progress', bench_progress, 2000),
+              ('remote_progress', bench_remote_progress, 2000),
+              ('theme_swap', bench_theme_swap, 200),
+              ('theme_swap_palette', partial(bench_theme_swap, palette=True), 200)]
+
+
+def run(font, repeat, scale, only=None, benchmarks=BENCHMARKS):
+    results = {}
+    for name, bench, n in benchmarks:
+        if only and name not in only:
+            continue
+        n = max(1, int(n * scale))
+        seconds = min(bench(font, n) for _ in range(repeat))
+        results[name] = {'ops': n,
+                         'seconds': seconds,
+                         'us_per_op': seconds / n * 1e6}
+    return {'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'platform': platform.platform(),
+            'font': os.path.basename(font),
+            'benchmarks': results}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        old = baseline['benchmarks'].get(name)
+        if old is None:
+            continue
+        ratio = result['us_per_op'] / old['us_per_op']
+        result['baseline_us_per_op'] = old['us_per_op']
+        result['ratio'] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    results['regressions'] = regressions
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark pysole hot paths.')
+    parser.add_argument('--font', default=None, help='font file, defaults to the pygame font')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the fastest is kept')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier for the amount of operations')
+    parser.add_argument('--only', nargs='*', help='names of the benchmarks to run')
+    parser.add_argument('--trace', help='recorded session to replay as the trace benchmark')
+    parser.add_argument('--output', help='file to write the JSON results to, stdout if not given')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='compare the results with the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slow down before a benchmark counts as a regression')
+    args = parser.parse_args(argv)
+
+    benchmarks = BENCHMARKS
+    if args.trace:
+        benchmarks = BENCHMARKS + [('trace', partial(bench_trace, args.trace), 1)]
+    results = run(args.font or default_font(), args.repeat, args.scale, args.only, benchmarks)
+
+    regressions = []
+    if args.compare:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
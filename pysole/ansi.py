@@ -0,0 +1,198 @@
+"""Pysole ANSI module.
+
+This module turns text containing ANSI escape sequences, such as the output
+of a program that colours its output for a terminal, into runs of text with a
+foreground and background colour, and cursor and erase controls.
+
+The parser keeps its state between calls to feed, so a stream can be fed in
+chunks of any size, even when an escape sequence or a multi byte character is
+split between two chunks.
+
+Example:
+    $ python3
+    >> from pysole.ansi import AnsiParser
+
+"""
+
+
+import codecs
+import re
+
+from pysole.colour import ConsoleColour
+
+
+# The 16 standard and bright colours, in ANSI order
+ANSI_COLOURS = [ConsoleColour.black, ConsoleColour.maroon, ConsoleColour.green, ConsoleColour.olive,
+                ConsoleColour.navy, ConsoleColour.purple, ConsoleColour.teal, ConsoleColour.silver,
+                ConsoleColour.gray, ConsoleColour.red, ConsoleColour.lime, ConsoleColour.yellow,
+                ConsoleColour.blue, ConsoleColour.fushia, ConsoleColour.aqua, ConsoleColour.white]
+
+_CUBE_LEVELS = (0, 95, 135, 175, 215, 255)
+
+# Control sequences, operating system commands and other two character escapes.
+# Operating system commands, such as setting the title, are ignored, and are
+# also ended by CAN, SUB or a newline so an unterminated one can't swallow the
+# rest of the stream.
+_ESCAPE = re.compile(r'\x1b(?:\[([0-?]*)[ -/]*([@-~])|\][^\x07\x1b\x18\x1a\n]*(?:\x07|\x1b\\|[\x18\x1a]|(?=\n))'
+                     r'|[@-Z\\-_])')
+# Longest operating system command held back waiting for its end, longer ones are written as text
+_MAX_OSC = 4096
+# An escape sequence that has not been completely received yet
+_PARTIAL = re.compile(r'\x1b(?:\[[0-?]*[ -/]*|\][^\x07\x1b\x18\x1a\n]{0,%d}\x1b?)?\Z' % _MAX_OSC)
+
+
+def colour_256(index):
+    """Returns the RGB colour of an index in the 256 colour palette."""
+    if index < 16:
+        return ANSI_COLOURS[index]
+    if index < 232:
+        index -= 16
+        return _CUBE_LEVELS[index // 36], _CUBE_LEVELS[index // 6 % 6], _CUBE_LEVELS[index % 6]
+    grey = 8 + (index - 232) * 10
+    return grey, grey, grey
+
+
+class AnsiParser(object):
+    """AnsiParser class splits a stream into coloured text runs and controls.
+
+    Args:
+        fg (int tuple): The default foreground colour
+        bg (int tuple): The default background colour
+
+    Attributes:
+        fg (int tuple): The current foreground colour
+        bg (int tuple): The current background colour
+
+    Note:
+        feed returns a list of operations, each one of
+        ('text', text, fg, bg),
+        ('move', columns, rows) to move the cursor relative to where it is,
+        ('position', column, row) to move the cursor, None keeping the current value,
+        ('erase_display', mode) and ('erase_line', mode), where mode 0 erases
+        from the cursor to the end, 1 from the start to the cursor and 2 everything.
+
+    """
+    def __init__(self, fg=(255, 255, 255), bg=(0, 0, 0)):
+        self.default_fg = fg
+        self.default_bg = bg
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._pending = ''
+        self.reset()
+
+    def reset(self):
+        """Resets every graphic rendition back to the defaults."""
+        # Colours are a palette index, an RGB tuple or None for the default
+        self._fg = None
+        self._bg = None
+        self._bold = False
+        self._reverse = False
+        self._resolve()
+
+    def _resolve(self):
+        fg = self._fg
+        if type(fg) is int:
+            fg = colour_256(fg + 8 if self._bold and fg < 8 else fg)
+        bg = colour_256(self._bg) if type(self._bg) is int else self._bg
+        fg = self.default_fg if fg is None else fg
+        bg = self.default_bg if bg is None else bg
+        if self._reverse:
+            fg, bg = bg, fg
+        self.fg = fg
+        self.bg = bg
+
+    def feed(self, data):
+        """Parses the next chunk of the stream, which can be str or bytes."""
+        if isinstance(data, (bytes, bytearray)):
+            data = self._decoder.decode(data)
+        data = self._pending + data
+        partial = _PARTIAL.search(data)
+        if partial is not None:
+            self._pending = data[partial.start():]
+            data = data[:partial.start()]
+        else:
+            self._pending = ''
+
+        ops = []
+        position = 0
+        for match in _ESCAPE.finditer(data):
+            if match.start() > position:
+                ops.append(('text', data[position:match.start()], self.fg, self.bg))
+            position = match.end()
+            if match.group(2) is not None:
+                self._control(match.group(1), match.group(2), ops)
+        if position < len(data):
+            ops.append(('text', data[position:], self.fg, self.bg))
+        return ops
+
+    def _control(self, params, final, ops):
+        if final == 'm':
+            self._sgr([int(p) if p.isdigit() else 0 for p in params.split(';')])
+            return
+        if params.startswith('?'):
+            # Private modes, such as showing the cursor, are not supported
+            return
+        args = [int(p) if p.isdigit() else None for p in params.split(';')] if params else [None]
+        n = args[0] or 1
+        if final == 'A':
+            ops.append(('move', 0, -n))
+        elif final == 'B':
+            ops.append(('move', 0, n))
+        elif final == 'C':
+            ops.append(('move', n, 0))
+        elif final == 'D':
+            ops.append(('move', -n, 0))
+        elif final in 'Hf':
+            row = args[0] or 1
+            column = (args[1] if len(args) > 1 else None) or 1
+            ops.append(('position', column - 1, row - 1))
+        elif final == 'G':
+            ops.append(('position', n - 1, None))
+        elif final == 'J':
+            ops.append(('erase_display', args[0] or 0))
+        elif final == 'K':
+            ops.append(('erase_line', args[0] or 0))
+
+    def _sgr(self, codes):
+        i = 0
+        while i < len(codes):
+            code = codes[i]
+            if code == 0:
+                self._fg = self._bg = None
+                self._bold = self._reverse = False
+            elif code == 1:
+                self._bold = True
+            elif code == 22:
+                self._bold = False
+            elif code == 7:
+                self._reverse = True
+            elif code == 27:
+                self._reverse = False
+            elif 30 <= code <= 37:
+                self._fg = code - 30
+            elif 90 <= code <= 97:
+                self._fg = code - 90 + 8
+            elif code == 39:
+                self._fg = None
+            elif 40 <= code <= 47:
+                self._bg = code - 40
+            elif 100 <= code <= 107:
+                self._bg = code - 100 + 8
+            elif code == 49:
+                self._bg = None
+            elif code in (38, 48) and i + 1 < len(codes):
+                # Extended colours, 5;n for the 256 colour palette or 2;r;g;b
+                colour = None
+                if codes[i + 1] == 5 and i + 2 < len(codes):
+                    colour = min(codes[i + 2], 255)
+                    i += 2
+                elif codes[i + 1] == 2 and i + 4 < len(codes):
+                    colour = tuple(min(c, 255) for c in codes[i + 2:i + 5])
+                    i += 4
+                else:
+                    i += 1
+                if colour is not None and code == 38:
+                    self._fg = colour
+                elif colour is not None:
+                    self._bg = colour
+            i += 1
+        self._resolve()
@@ -21,9 +21,23 @@ Note:
 """
 
 
+class _ColourTable(type):
+    # Lets the colours of the ConsoleColour class be iterated over
+    def __iter__(cls):
+        for _, col in cls.items():
+            yield col
+
+    def __len__(cls):
+        return sum(1 for _ in cls.items())
+
+
 # http://www.flounder.com/csharp_color_table.htm
 # noinspection PyPep8
-class ConsoleColour(object):
+class ConsoleColour(object, metaclass=_ColourTable):
+    # Lookup tables of the palette, built when first used
+    _indices = None
+    _palette = None
+
     alice_blue =             (240, 248, 255)
     antique_white =          (250, 235, 215)
     aqua =                   (  0, 255, 255)
@@ -166,12 +180,49 @@ class ConsoleColour(object):
     yellow_green =           (154, 205,  50)
 
 
-    def __iter__():
-        for col in list(vars(ConsoleColour).values()):
+    @classmethod
+    def items(cls):
+        """Yields the (name, RGB value) of every colour, in the order of their indices."""
+        for name, col in list(vars(cls).items()):
             if type(col) is tuple:
-                yield col
+                yield name, col
 
-    def items():
-        for col in list(vars(ConsoleColour).values()):
-            if type(col) is tuple:
-                yield col
+    @classmethod
+    def index(cls, colour):
+        """Returns the index of a colour in the palette.
+
+        Args:
+            colour (str or int tuple): The name or RGB value of a colour
+
+        Returns:
+            int: The index, for an RGB value the index of the first colour
+                with that value.
+
+        Raises:
+            KeyError: If there is no colour with that name or RGB value.
+
+        """
+        if cls._indices is None:
+            cls._build_palette()
+        if isinstance(colour, str):
+            return cls._indices[colour]
+        return cls._indices[tuple(colour[:3])]
+
+    @classmethod
+    def palette(cls):
+        """Returns the RGB value of every colour, ordered by index, at most 256
+        so it can be the palette of an 8 bit surface."""
+        if cls._indices is None:
+            cls._build_palette()
+        return list(cls._palette)
+
+    @classmethod
+    def _build_palette(cls):
+        palette = []
+        indices = {}
+        for i, (name, col) in enumerate(cls.items()):
+            palette.append(col)
+            indices[name] = i
+            indices.setdefault(col, i)
+        cls._palette = palette
+        cls._indices = indices
@@ -20,8 +20,25 @@ Exceptions:
 '''
 
 
+import io
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_right
+from collections import deque
+from time import monotonic, perf_counter
+
+import pygame
+from pygame.locals import K_BACKSPACE, K_KP_ENTER, K_RETURN
+
+from pysole.ansi import AnsiParser
 from pysole.colour import ConsoleColour
-from pysole.window import *
+from pysole.screen import ScreenBuffer, unpack_colour
+from pysole.scrollback import DiskScrollback, Scrollback
+from pysole.search import SearchIndex, literals
+from pysole.stats import FrameStats
+from pysole.window import Canvas, CharacterString, Display, Font, GlyphAtlas, KeyEvent, Region, Theme
 
 
 class ConsoleError(Exception):
@@ -33,6 +50,10 @@ class ConsoleConfigError(Exception):
         self.message = message
 
 class Console:
+    # Longest an awaited read goes without checking for input, when it has
+    # nothing to draw and the fps is higher or unlimited
+    INPUT_POLL_MS = 10
+
     def __init__(self, config=None):
         '''Initialises a terminal object and an inner display object.
 
@@ -45,6 +66,7 @@ class Console:
         self._config = {'title': 'Pyterm',
                         'icon': None,
                         'fps': 60,
+                        'min_fps': 1,
                         'line_cutoff': 2000,
                         'default_background_colour': ConsoleColour.black,
                         'default_foreground_colour': ConsoleColour.white,
@@ -59,43 +81,244 @@ class Console:
                         'font': None,
                         'font_size': 10,
                         'antialiasing': False,
-                        'anchor': 'bottom'
+                        'anchor': 'bottom',
+                        'buffered': False,
+                        'auto_present': True,
+                        'screen_buffer': False,
+                        'headless': False,
+                        'threaded': False,
+                        'wrap': True,
+                        'surface_cache_bytes': 32 * 1024 * 1024,
+                        'scrollback_file': None,
+                        'highlight_colour': ConsoleColour.navy,
+                        'key_queue_size': 1024,
+                        'stats': False,
+                        'hud': False,
+                        'record_file': None,
+                        'scroll_input': True,
+                        'palette_text': False,
+                        'remote': None
                         }
 
         if config is not None:
             self.change_config(config)
 
-        self.background_colour = self._config['default_background_colour']
-        self.foreground_colour = self._config['default_foreground_colour']
+        CharacterString.cache.budget = self._config['surface_cache_bytes']
+        # Every colour is shown as written until set_theme is called
+        Theme.palette = self._config['palette_text']
+        CharacterString.cache.clear()
+        Theme.set({}, self._config['default_background_colour'])
+
+        # Frame timings and counters, collected when enabled or shown on the hud
+        self.stats = None
+        if self._config['stats'] or self._config['hud']:
+            self.stats = FrameStats()
+        Font.stats = Canvas.stats = self.stats
+        self.hud = self._config['hud']
 
         self.title = self._config['title']
         self.icon = self._config['icon']
         self._fps = self._config['fps']
-        self._display = Display(self.title, self._fps, self.icon,
-                                size=(self._config['default_width'],
-                                      self._config['default_height']),
-                                min_size=(self._config['default_min_width'],
-                                          self._config['default_min_height']),
-                                resizeable=self._config['resizeable'],
-                                beep_sound=self._config['beep_sound'])
+        # Frames that have nothing to draw wait for input instead, for at most
+        # this many ms so idle frames are still presented min_fps times a second
+        min_fps = self._config['min_fps']
+        self._idle_ms = max(1, int(1000 / min_fps)) if min_fps else 0
+        # Buffered writes only touch the text buffer, frames are presented
+        # explicitly or at most once per frame interval when auto presenting.
+        self.buffered = self._config['buffered']
+        self.auto_present = self._config['auto_present']
+        self._last_present = 0
+
+        # In threaded mode a render thread owns the display, writes from any
+        # thread are queued and the whole queue is applied once per frame.
+        self._render_thread = None
+        self._queue = deque()
+        self._running = False
+        self._frames = 0
+        self._frame_done = threading.Condition()
+        # Set by the render thread before a frame that may wait for input
+        self._sleeping = False
+        self._loop_start = threading.Event()
+        if self._config['threaded']:
+            self._start_render_thread()
+        else:
+            self._display = self._create_display()
+        # Where the console draws, the whole window unless given a region
+        self._canvas = self._display
+        # Panes drawn in the same window, see add_pane
+        self._panes = []
 
         if self._config['font'] is not None:
             self.default_font = Font(self._config['font'], self._config['font_size'])
         else:
             raise ConsoleConfigError('The font configuration file was not provided')
 
-        self.row_height = self.default_font.font.size('s')[0]
-        self.col_width = self.default_font.font.size('s')[0]
+        self.STD_ROW_HEIGHT = self.default_font.font.size('O')[1]
+        self.row_height = self.STD_ROW_HEIGHT
+        self.col_width = self.default_font.advance
+
+        self.run_time = self._display.get_run_time()
+
+        # Trace of the calls made on the console, see replay
+        self._recorder = None
+        if self._config['record_file'] is not None:
+            # The record and remote modules are only imported when configured,
+            # most consoles use neither and json and the sockets are slow to import
+            from pysole.record import Recorder
+            self._recorder = Recorder(self._config['record_file'], self._config)
+
+        self._init_buffer()
+
+        # Clients watching the console from other processes, see _publish
+        self._remote = None
+        self.remote_address = None
+        if self._config['remote'] is not None:
+            from pysole.remote import RemoteServer
+            self._remote = RemoteServer(self._config['remote'], self._remote_key, self._display.wake)
+            self.remote_address = self._remote.address
+
+        if self._render_thread is not None:
+            self._loop_start.set()
+        else:
+            self._core_update()
+
+    def _init_buffer(self):
+        '''Sets up the text buffer, cursor, colours and scrolling of the console'''
+        self.background_colour = self._config['default_background_colour']
+        self.foreground_colour = self._config['default_foreground_colour']
+        # Set when the buffer changed since the last frame
+        self._changed = True
 
-        self._row = 0
         self._column = 0
 
-        self.STD_ROW_HEIGHT = self.default_font.font.size('O')[1]
+        # Written lines, the last line is the one the cursor is on. With a
+        # scrollback file every line is kept on disk instead of the newest line_cutoff.
+        if self._config['scrollback_file'] is not None:
+            self._lines = DiskScrollback(self._config['scrollback_file'], self._stored_string)
+        else:
+            self._lines = Scrollback(self._config['line_cutoff'])
+        self._lines.append()
+        # Line and wrapped row of that line shown at the top of the window
+        self._top = 0
+        self._top_row = 0
+        # Whether the viewport moves down to keep the cursor row in view
+        self._follow = True
 
-        self.run_time = self._display.get_run_time()
+        # Damage tracking, only dirty lines are redrawn unless a full repaint is needed
+        self._dirty = set()
+        self._repaint = True
+        # Where the rows of lines start, for text wrapped by width, see _row_starts
+        self._wraps = {}
+        self._painted_layout = None
+        self._painted_bg = None
 
-        self._frame = []
-        self._core_update()
+        # Search index of the scrollback, lines are added when a search needs them
+        self._search = SearchIndex()
+        self._find_pattern = None
+        self._find_runs = None
+        # Line, first and end column of the highlighted match
+        self._match = None
+
+        # Optional character cell buffer that replaces the scrollback
+        self.screen = None
+        self._screen_shown = None
+        self._ansi = None
+        # What remote clients were last sent, see _publish
+        self._remote_last = None
+        self._remote_view = None
+        self._remote_shown = None
+        if self._config['screen_buffer']:
+            self.screen = ScreenBuffer(max(1, self._canvas.width // self.default_font.advance),
+                                       max(1, self._canvas.height // self.STD_ROW_HEIGHT),
+                                       self.foreground_colour, self.background_colour)
+
+    def _create_display(self):
+        return Display(self.title, self._fps, self.icon,
+                       size=(self._config['default_width'],
+                             self._config['default_height']),
+                       min_size=(self._config['default_min_width'],
+                                 self._config['default_min_height']),
+                       resizeable=self._config['resizeable'],
+                       beep_sound=self._config['beep_sound'],
+                       headless=self._config['headless'],
+                       key_queue_size=self._config['key_queue_size'])
+
+    def _start_render_thread(self):
+        '''Starts the render thread and waits for it to create the display'''
+        display_ready = threading.Event()
+        self._running = True
+        self._render_thread = threading.Thread(target=self._render_loop, args=(display_ready,),
+                                               name='pysole-render', daemon=True)
+        self._render_thread.start()
+        display_ready.wait()
+        if self._display is None:
+            raise ConsoleError('The render thread could not create the display.')
+
+    def _render_loop(self, display_ready):
+        '''Owns the display, applies queued output and presents once per frame'''
+        self._display = None
+        try:
+            self._display = self._create_display()
+        finally:
+            display_ready.set()
+        self._loop_start.wait()
+        try:
+            while self._running:
+                self._drain()
+                self._sleeping = True
+                self._core_update(idle=self._idle_ms)
+                self._sleeping = False
+                with self._frame_done:
+                    self._frames += 1
+                    self._frame_done.notify_all()
+        finally:
+            self._running = False
+            with self._frame_done:
+                self._frame_done.notify_all()
+
+    def _drain(self):
+        '''Applies every queued change, joining runs of writes with the same colours'''
+        parts = []
+        colours = None
+        if self._queue:
+            self._changed = True
+        while self._queue:
+            func, args = self._queue.popleft()
+            if func == self._put and parts and args[1:] == colours:
+                parts.append(args[0])
+                continue
+            if parts:
+                self._put(''.join(parts), *colours)
+                parts = []
+            if func == self._put:
+                parts.append(args[0])
+                colours = args[1:]
+            else:
+                func(*args)
+        if parts:
+            self._put(''.join(parts), *colours)
+
+    def _apply(self, func, *args):
+        '''Changes the buffer now, or queues the change for the render thread'''
+        if self._render_thread is None:
+            func(*args)
+            self._changed = True
+        elif self._running:
+            self._queue.append((func, args))
+            if self._sleeping:
+                self._sleeping = False
+                self._display.wake()
+        else:
+            raise ConsoleError('The console render thread has stopped.')
+
+    def _wait_frame(self):
+        '''Blocks until the render thread has presented another frame, raises
+        ConsoleError if it has stopped, such as after the window was closed'''
+        with self._frame_done:
+            frame = self._frames
+            self._frame_done.wait_for(lambda: self._frames > frame or not self._running)
+            if not self._running:
+                raise ConsoleError('The console render thread has stopped.')
 
 
     def change_config(self, config):
@@ -108,72 +331,911 @@ class Console:
             except KeyError:
                 raise ConsoleConfigError('An invalid key ' + '\'' + str(k) + '\'' + ' was provided.')
 
-    def _core_update(self):
-        '''Completes one frame of the display'''
-        self._display.step(self.background_colour)
-        for text in self._frame:
-            self._display.display_text(text)
+    def _core_update(self, wait=True, idle=None):
+        '''Completes one frame of the display, redrawing only what changed. If
+        idle is given and there is nothing to draw, the frame waits up to idle
+        ms for input instead of polling, 0 waiting until there is input.'''
+        if self._render_thread is not None and threading.current_thread() is not self._render_thread:
+            if idle is None:
+                self._display.wake()
+            self._wait_frame()
+            return
+        if idle is not None and self._busy():
+            idle = None
+        stats = self.stats
+        if stats is not None:
+            start = perf_counter()
+        self._display.step(wait, idle)
+        if stats is not None:
+            stepped = perf_counter()
+            stats.add('wait', self._display.waited)
+            stats.add('events', stepped - start - self._display.waited)
+        for pos, rows, pages in self._display.get_scrolls():
+            if self._config['scroll_input']:
+                self._scroll_input(pos, rows, pages)
+
+        cleared = self._display.clear_overlay()
+        if self._display.damaged and self._canvas is not self._display:
+            # Parts of the window may not be covered by the console or any pane
+            self._display.fill(self.background_colour)
+            rects = None
+        else:
+            rects = []
+        if self._remote is not None:
+            # Drawing forgets what changed, but settles the view that is sent with it
+            changes = (self._needs_draw(), self._repaint, set(self._dirty))
+        drawn = self._draw()
+        if self._remote is not None:
+            self._publish(*changes)
+        rects = None if rects is None or drawn is None else rects + drawn
+        for pane in self._panes:
+            # Panes that did not change are left alone
+            if pane._needs_draw():
+                drawn = pane._draw()
+                if rects is not None:
+                    rects.extend(drawn)
+        if rects is not None and cleared is not None:
+            rects.append(cleared)
+        if stats is not None:
+            drawn = perf_counter()
+            stats.add('draw', drawn - stepped)
+        if self.hud and stats is not None:
+            hud = self._display.draw_overlay(self._hud_lines(), self.default_font,
+                                             ConsoleColour.lime, ConsoleColour.black)
+            if rects is not None:
+                rects.append(hud)
+        self._display.damaged = False
+
         self.run_time = self._display.get_run_time()
-        self._display.update()
+        if stats is not None:
+            updating = perf_counter()
+        self._display.update(rects)
+        self._last_present = monotonic()
+        if stats is not None:
+            done = perf_counter()
+            stats.add('update', done - updating)
+            stats.add('frame', done - start - self._display.waited)
+            stats.add('surface_bytes', CharacterString.cache.size)
+            stats.end_frame()
+
+    def _hud_lines(self):
+        '''Text of the performance hud, average ms of each phase over the last frames'''
+        stats = self.stats
+        ms = dict((name, stats.mean(name) * 1000) for name in stats.PHASES)
+        return ['%.0f fps  frame %.2f ms  p95 %.2f ms' % (stats.fps, ms['frame'],
+                                                       stats.percentile('frame', 95) * 1000),
+                'events %.2f  draw %.2f  update %.2f' % (ms['events'], ms['draw'], ms['update']),
+                'fill %.2f  blit %.2f  render %.2f' % (ms['fill'], ms['blit'], ms['render']),
+                '%d lines  %d blits  %d renders  %d KB' % (stats.mean('lines'), stats.mean('blits'),
+                                                         stats.mean('renders'),
+                                                         stats.mean('surface_bytes') // 1024)]
+
+    def get_stats(self):
+        '''Returns the fps, timings of each phase of a frame in ms and counters,
+        see FrameStats.summary'''
+        return self._require_stats().summary()
+
+    def add_frame_callback(self, callback):
+        '''Calls callback with the timings and counters of every frame once it is
+        presented, on the render thread in threaded mode'''
+        self._require_stats().callbacks.append(callback)
+
+    def remove_frame_callback(self, callback):
+        self._require_stats().callbacks.remove(callback)
+
+    def _require_stats(self):
+        if self.stats is None:
+            raise ConsoleConfigError('The stats configuration must be enabled to collect frame stats.')
+        return self.stats
+
+    def _busy(self):
+        '''Whether the next frame has something to draw'''
+        return bool(self._queue) or self._needs_draw() or any(pane._needs_draw() for pane in self._panes)
+
+    def _needs_draw(self):
+        '''Whether the console's area has to be drawn again'''
+        return (self._changed or self._repaint or self._canvas.damaged or
+                self.background_colour != self._painted_bg)
+
+    def _draw(self):
+        '''Draws what changed in the console's area, returns the rects drawn or None for the whole window'''
+        if self.screen is not None:
+            rects = self._draw_screen()
+        else:
+            rects = self._draw_lines()
+        self._changed = False
+        self._repaint = False
+        self._canvas.damaged = False
+        if rects is None and self._canvas is not self._display:
+            rects = [self._canvas.rect]
+        return rects
+
+    def _draw_lines(self):
+        '''Draws the rows of the scrollback that changed, returns the rects drawn or None for all'''
+        self._check_write_bounds()
+        rows = self._visible_rows()
+        columns = self._columns()
+        layout = self._layout(rows, columns)
+        painted = self._painted_layout
+
+        full = (self._repaint or self._canvas.damaged or painted is None or
+                self.background_colour != self._painted_bg)
+        shift = 0
+        if not full:
+            # Find how far the rows already drawn have moved
+            index = dict((pos, i) for i, pos in enumerate(painted) if pos is not None)
+            if layout[0] in index:
+                shift = index[layout[0]]
+            elif painted[0] in layout:
+                shift = -layout.index(painted[0])
+            else:
+                full = True
+
+        if full:
+            self._canvas.fill(self.background_colour)
+            rects = None
+        elif shift:
+            # Move what is already drawn and only draw the rows that are new
+            self._canvas.scroll(-shift * self.STD_ROW_HEIGHT)
+            rects = None
+        else:
+            rects = []
+
+        drawn = 0
+        for i, pos in enumerate(layout):
+            if not full and 0 <= i + shift < len(painted) and painted[i + shift] == pos and \
+                    pos[0] not in self._dirty:
+                continue
+            y = i * self.STD_ROW_HEIGHT
+            rect = self._canvas.fill(self.background_colour,
+                                     (0, y, self._canvas.width, self.STD_ROW_HEIGHT))
+            self._draw_row(pos, y, columns)
+            drawn += 1
+            if rects is not None:
+                rects.append(rect)
+        if self.stats is not None:
+            self.stats.add('lines', drawn)
+
+        if self._canvas.height % self.STD_ROW_HEIGHT:
+            # The last row is only partly drawn, so it can't be moved into view
+            layout[-1] = None
+        self._painted_layout = layout
+        self._painted_bg = self.background_colour
+        self._dirty.clear()
+        return rects
 
-    def _trim_lines(self, size):
-        '''Deletes lines from the start of the frame to the value of size'''
-        if len(self._frame) > size:
-            i = 0
-            while i < len(self._frame) - size:
-                self._frame.remove(self._frame[i])
-                i += 1
+    def _draw_row(self, pos, y, columns):
+        '''Draws the part of a line that wraps onto one row'''
+        line, row = pos
+        if not self._lines.first <= line <= self._lines.last:
+            return
+        if self._wraps_by_width():
+            starts = self._row_starts(line)
+            if row >= len(starts):
+                return
+            start = starts[row]
+            end = starts[row + 1] if row + 1 < len(starts) else sys.maxsize
+        else:
+            start = row * columns
+            end = start + columns
+        text = self._lines[line]
+        match = self._match
+        if match is not None and match[0] == line:
+            first = max(match[1], start)
+            last = min(match[2], end)
+            if first < last:
+                x = self._column_x(text, first, start)
+                self._canvas.fill(self._config['highlight_colour'],
+                                   (x, y, self._column_x(text, last, start) - x, self.STD_ROW_HEIGHT))
+        for cs in text:
+            column = cs.x // self.col_width
+            first = max(column, start)
+            last = min(column + len(cs.text), end)
+            if first < last:
+                self._canvas.blits(cs.blits(y, first - column, last - column,
+                                             self._column_x(text, first, start)))
+
+    def _column_x(self, text, column, start):
+        '''Returns the x position a column of a line is drawn at on the row starting at column start'''
+        if self.default_font.monospace:
+            return (column - start) * self.col_width
+        return self.default_font.width(self._line_text(text)[start:column])
+
+    def _line_text(self, text):
+        '''Returns the characters of a line by column, columns no string covers being spaces'''
+        chars = ''
+        for cs in text:
+            chars += ' ' * (cs.x // self.col_width - len(chars)) + cs.text
+        return chars
+
+    def _draw_screen(self):
+        '''Draws the cells of the screen buffer that changed since the last frame'''
+        if self._repaint or self._canvas.damaged:
+            self._canvas.fill(self.background_colour)
+            self._screen_shown = None
+            rects = None
+        else:
+            rects = []
+
+        screen = self.screen
+        width = self.default_font.advance
+        height = self.STD_ROW_HEIGHT
+        left, top = self._canvas.offset
+        antialiasing = self._config['antialiasing']
+        for row, first, end in screen.changes(self._screen_shown):
+            if self.stats is not None:
+                self.stats.add('lines', 1)
+            y = row * height
+            start = row * screen.columns
+            for column in range(first, end):
+                x = column * width
+                self._canvas.fill(unpack_colour(screen.bg[start + column]), (x, y, width, height))
+                char = chr(screen.chars[start + column])
+                if char != ' ':
+                    atlas = GlyphAtlas.get(self.default_font, unpack_colour(screen.fg[start + column]),
+                                           antialiasing)
+                    self._canvas.blits(atlas.blits(char, x, y))
+            if rects is not None:
+                rects.append((first * width + left, y + top, (end - first) * width, height))
+
+        self._screen_shown = screen.snapshot()
+        self._painted_bg = self.background_colour
+        return rects
+
+    def _present_if_due(self):
+        '''Completes a frame after a write, unless buffered and not yet due'''
+        if self._render_thread is not None:
+            return
+        if not self.buffered:
+            self._core_update()
+        elif self.auto_present and self._fps:
+            if monotonic() - self._last_present >= 1 / self._fps:
+                self._core_update()
+
+    def _visible_rows(self):
+        '''Number of rows that fit in the window, including a partial last row'''
+        return max(1, -(-self._canvas.height // self.STD_ROW_HEIGHT))
+
+    def _columns(self):
+        '''Number of columns text wraps after'''
+        if not self._config['wrap']:
+            return sys.maxsize
+        return max(1, self._canvas.width // self.col_width)
+
+    def _wraps_by_width(self):
+        '''Whether lines wrap where their text reaches the width of the console,
+        as proportional fonts do, rather than after a number of columns'''
+        return self._config['wrap'] and not self.default_font.monospace
+
+    def _row_starts(self, line):
+        '''Returns the column each row of a line starts at when it wraps by
+        width, worked out from the cached advances of its characters and kept
+        until the line or the width of the console changes'''
+        text = self._lines[line] if line <= self._lines.last else None
+        if not text:
+            return [0]
+        width = self._canvas.width
+        # Strings are replaced rather than changed, so the line is the same
+        # while it holds the same strings
+        key = (width, tuple(text))
+        wrapped = self._wraps.get(line)
+        if wrapped is not None and wrapped[0] == key:
+            return wrapped[1]
+        width = max(1, width)
+        f = self.default_font
+        starts = [0]
+        x = 0
+        for column, char in enumerate(self._line_text(text)):
+            advance = f.width(char)
+            if x and x + advance > width:
+                starts.append(column)
+                x = 0
+            x += advance
+        if len(self._wraps) > 2 * self._config['line_cutoff']:
+            self._wraps.clear()
+        self._wraps[line] = (key, starts)
+        return starts
+
+    def _column_row(self, line, column, columns):
+        '''Returns the row of a line a column wraps onto'''
+        if self._wraps_by_width():
+            return bisect_right(self._row_starts(line), column) - 1
+        return column // columns
+
+    def _line_rows(self, line, columns):
+        '''Number of rows a line wraps onto, worked out from its length so
+        lines are only reflowed when they are laid out'''
+        if self._config['wrap'] and not self.default_font.monospace:
+            return len(self._row_starts(line))
+        text = self._lines[line] if line <= self._lines.last else None
+        if not text:
+            return 1
+        length = max(cs.x // self.col_width + len(cs.text) for cs in text)
+        return max(1, -(-length // columns))
+
+    def _layout(self, rows, columns):
+        '''Returns the (line, row) on each screen row, from the top of the viewport'''
+        layout = []
+        line, row = self._top, self._top_row
+        count = self._line_rows(line, columns)
+        while len(layout) < rows:
+            layout.append((line, row))
+            row += 1
+            if row >= count:
+                line += 1
+                row = 0
+                count = self._line_rows(line, columns)
+        return layout
 
     def _check_write_bounds(self):
-        '''Scroll function, will scroll if text is going off screen'''
-        col_height = self._row * self.default_font.font.size('s')[1]
-        win_height = self._display.height
+        '''Scroll function, moves the viewport down if the cursor row is off screen'''
+        columns = self._columns()
+        if self._top < self._lines.first:
+            self._top, self._top_row = self._lines.first, 0
+        self._top_row = min(self._top_row, self._line_rows(self._top, columns) - 1)
+        if not self._follow:
+            return
+
+        # Walk back from the cursor row to the row that would be at the top with
+        # the cursor row at the bottom, only visiting rows below the current top
+        line = self._lines.last
+        row = self._line_rows(line, columns) - 1
+        need = self._visible_rows() - 1
+        while need > row and line > self._top:
+            need -= row + 1
+            line -= 1
+            row = self._line_rows(line, columns) - 1
+        if need <= row and (line, row - need) > (self._top, self._top_row):
+            self._top, self._top_row = line, row - need
+
+    def _bottom(self, columns):
+        '''Returns the (line, row) at the top of the viewport when it follows the cursor row'''
+        last = self._lines.last
+        return self._rows_back(last, self._line_rows(last, columns) - 1,
+                               self._visible_rows() - 1, columns)
+
+    def _rows_forward(self, line, row, count, columns):
+        '''Returns the (line, row) count rows after a row, stopping at the newest row'''
+        rows = self._line_rows(line, columns)
+        while row + count >= rows and line < self._lines.last:
+            count -= rows - row
+            line += 1
+            row = 0
+            rows = self._line_rows(line, columns)
+        return line, min(row + count, rows - 1)
+
+    def _rows_back(self, line, row, count, columns):
+        '''Returns the (line, row) count rows before a row, stopping at the oldest row'''
+        while count > row and line > self._lines.first:
+            count -= row + 1
+            line -= 1
+            row = self._line_rows(line, columns) - 1
+        return line, max(0, row - count)
+
+    def scroll_by(self, rows):
+        '''Moves the viewport rows rows down the scrollback, or up into earlier
+        output if rows is negative. Once the viewport reaches the cursor row it
+        follows the output again.'''
+        self._require_scrollback()
+        if self._recorder is not None:
+            self._record('scroll_by', rows)
+        self._apply(self._scroll_rows, rows)
+        self._present_if_due()
+
+    def scroll_to(self, line):
+        '''Moves the viewport so a line of the scrollback, numbered like the
+        lines find returns, is at the top, or as near the top as it can be.'''
+        self._require_scrollback()
+        if self._recorder is not None:
+            self._record('scroll_to', line)
+        self._apply(self._scroll_to, line)
+        self._present_if_due()
+
+    def _require_scrollback(self):
+        if self.screen is not None:
+            raise ConsoleConfigError('Scrolling is only supported without the screen_buffer configuration.')
+
+    def _scroll_rows(self, rows):
+        columns = self._columns()
+        self._check_write_bounds()
+        if rows < 0:
+            top = self._rows_back(self._top, self._top_row, -rows, columns)
+        else:
+            top = self._rows_forward(self._top, self._top_row, rows, columns)
+        self._scroll_top(top, columns)
+
+    def _scroll_to(self, line):
+        self._check_write_bounds()
+        line = min(max(line, self._lines.first), self._lines.last)
+        self._scroll_top((line, 0), self._columns())
+
+    def _scroll_top(self, top, columns):
+        '''Moves the top of the viewport, following the output again if it
+        would show past the cursor row'''
+        bottom = self._bottom(columns)
+        self._follow = top >= bottom
+        self._top, self._top_row = min(top, bottom)
 
-        if col_height >= win_height:
-            for cs in self._frame:
-                cs.y -= self.STD_ROW_HEIGHT
-            self._row -= 1
+    def _scroll_input(self, pos, rows, pages):
+        '''Scrolls for PageUp and PageDown, or the pane under the mouse for the wheel'''
+        view = self
+        if pos is not None:
+            for pane in self._panes:
+                if pane._canvas.rect.collidepoint(pos):
+                    view = pane
+        if view.screen is None:
+            # A page keeps one row of the last page in view
+            page = max(1, view._canvas.height // view.STD_ROW_HEIGHT - 1)
+            rows += pages * page
+            if view._recorder is not None:
+                view._record('scroll_by', rows)
+            view._scroll_rows(rows)
+            view._changed = True
+
+    def _new_line(self):
+        '''Moves the cursor to the start of the next line'''
+        if self.screen is not None:
+            self.screen.write('\n', self.foreground_colour, self.background_colour)
+        else:
+            self._lines.append()
+        self._column = 0
 
-        self._trim_lines(self._config['line_cutoff'])
+    def set_cursor_position(self, left, top):
+        '''Moves the cursor to a column and row of the screen buffer'''
+        screen = self._require_screen()
+        if not screen.contains(left, top):
+            raise ConsoleError('The cursor position is outside the screen buffer.')
+        if self._recorder is not None:
+            self._record('set_cursor_position', left, top)
+        self._apply(screen.set_cursor_position, left, top)
+
+    def get_cursor_position(self):
+        '''Returns the (column, row) of the cursor in the screen buffer, or its
+        (column, line number) in the scrollback'''
+        if self.screen is None:
+            return self._column, self._lines.last
+        return self.screen.get_cursor_position()
+
+    def get_cell(self, left, top):
+        '''Returns the (character, foreground, background) of a screen buffer cell'''
+        return self._require_screen().get_cell(left, top)
+
+    def _require_screen(self):
+        if self.screen is None:
+            raise ConsoleConfigError('The screen_buffer configuration must be enabled to address cells.')
+        return self.screen
 
     def get_size(self):
-        return (self._display.width // self.col_width, self._display.height // self.row_height)
+        return (self._canvas.width // self.col_width, self._canvas.height // self.row_height)
+
+    def _put(self, text, fg, bg):
+        '''Adds text to the buffer in the given colours without presenting,
+        splitting it into lines in one pass'''
+        if self.screen is not None:
+            self.screen.write(text, fg, bg)
+            return
+        for i, line in enumerate(text.split('\n')):
+            if i:
+                self._new_line()
+            if '\r' in line:
+                # A carriage return moves the cursor back to the start of the line
+                parts = line.split('\r')
+                for part in parts[:-1]:
+                    if part:
+                        self._put_fragment(part, fg)
+                    self._column = 0
+                line = parts[-1]
+            if line:
+                self._put_fragment(line, fg)
+
+    def _put_fragment(self, text, fg):
+        '''Adds text without newlines to the cursor line, joining it onto the
+        last string on the line if that ends at the cursor in the same colour'''
+        advance = self.col_width
+        text_line = self._lines[self._lines.last]
+        self._dirty.add(self._lines.last)
+        last = text_line[-1] if text_line else None
+        if last is not None and self._column < last.x // advance + len(last.text):
+            # The cursor is before the end of the line, so the text replaces what is there
+            self._lines[self._lines.last] = self._overwrite(text_line, self._column, text, fg)
+            self._column += len(text)
+            return
+        if (last is not None and last.col == fg and
+                last.x == (self._column - len(last.text)) * advance):
+            last.release()
+            text_line[-1] = last + text
+        else:
+            # Text is positioned by its line, so only x is stored on the string
+            text_line.append(CharacterString(text, self.default_font, (self._column * advance, 0),
+                                             fg, self._config['antialiasing']))
+        self._column += len(text)
+
+    def _overwrite(self, text_line, column, text, fg):
+        '''Returns the strings of a line with text written over it from a column.
+        Strings outside of the text are kept as they are, only the parts of
+        strings the text partly covers are made again.'''
+        advance = self.col_width
+        stop = column + len(text)
+        kept = []
+        for cs in text_line:
+            first = cs.x // advance
+            end = first + len(cs.text)
+            if end <= column or first >= stop:
+                kept.append(cs)
+                continue
+            cs.release()
+            if first < column:
+                kept.append(CharacterString(cs.text[:column - first], cs.f, (cs.x, cs.y),
+                                            cs.col, cs.antialiasing))
+            if end > stop:
+                kept.append(CharacterString(cs.text[stop - first:], cs.f, (stop * advance, cs.y),
+                                            cs.col, cs.antialiasing))
+        kept.append(CharacterString(text, self.default_font, (column * advance, 0), fg,
+                                    self._config['antialiasing']))
+        kept.sort(key=lambda cs: cs.x)
+        return kept
+
+    def write_at(self, left, top, text):
+        '''Writes text from a column of a screen buffer row or scrollback line,
+        replacing what is there, without moving the cursor. Lines are numbered
+        like get_cursor_position returns them and negative lines count back
+        from the cursor line, -1 being the cursor line. Text past the end of a
+        screen buffer row is cut off.'''
+        text = str(text)
+        self._check_in_place(left, top, text)
+        if self._recorder is not None:
+            self._record('write_at', left, top, text)
+        self._apply(self._put_at, left, top, text, self.foreground_colour, self.background_colour, False)
+        self._present_if_due()
+
+    def update_line(self, top, text):
+        '''Replaces the whole text of a screen buffer row or scrollback line,
+        numbered like in write_at, without moving the cursor. Only the changed
+        line is drawn again, so it can be updated many times a second.'''
+        text = str(text)
+        self._check_in_place(0, top, text)
+        if self._recorder is not None:
+            self._record('update_line', top, text)
+        self._apply(self._put_at, 0, top, text, self.foreground_colour, self.background_colour, True)
+        self._present_if_due()
+
+    def _check_in_place(self, left, top, text):
+        '''Raises a ConsoleError if text can't be written in place at a position'''
+        if '\n' in text or '\r' in text:
+            raise ConsoleError('Text written in place can not contain line breaks.')
+        if self.screen is not None:
+            if not self.screen.contains(left, top):
+                raise ConsoleError('The position is outside the screen buffer.')
+            return
+        line = top + self._lines.last + 1 if top < 0 else top
+        if left < 0 or not self._lines.first <= line <= self._lines.last:
+            raise ConsoleError('The line is not in the scrollback.')
+        if self._config['scrollback_file'] is not None and line != self._lines.last:
+            raise ConsoleError('Only the cursor line can be changed with the scrollback_file configuration.')
+
+    def _put_at(self, left, top, text, fg, bg, replace):
+        '''Writes text in place, see write_at'''
+        if self.screen is not None:
+            screen = self.screen
+            if replace:
+                screen.fill(0, top, screen.columns, 1, bg=bg)
+            cursor = screen.get_cursor_position()
+            screen.set_cursor_position(left, top)
+            screen.write(text[:screen.columns - left], fg, bg)
+            screen.set_cursor_position(*cursor)
+            return
+        line = top + self._lines.last + 1 if top < 0 else top
+        if not self._lines.first <= line <= self._lines.last:
+            # The line was dropped from the scrollback before this was applied
+            return
+        text_line = self._lines[line]
+        if replace:
+            for cs in text_line:
+                cs.release()
+            text_line = []
+        if text:
+            text_line = self._overwrite(text_line, left, text, fg)
+        self._lines[line] = text_line
+        self._dirty.add(line)
+        if line < self._search.end:
+            self._search.change(line)
 
     def write_line(self, text=''):
         '''Writes text to the display with a new line.'''
-        if text:
-            self._frame += [CharacterString(text, self.default_font,
-                                           (self._column * (self.default_font.font.size('O')[0]),
-                                            self._row * self.STD_ROW_HEIGHT),
-                                            self.foreground_colour, self._config['antialiasing'])]
-        self._row += 1
-        self._column = 0
-        self._check_write_bounds()
-        self._core_update()
+        self.write(str(text) + '\n')
 
     def write(self, text):
-        '''Writes text to display'''
+        '''Writes text to display, each newline in the text starts a new line.
+        Returns the number of characters written, like a text stream.'''
+        text = str(text)
+        self._check_open()
+        if text and self._recorder is not None:
+            self._record('write', text)
+        return self._write(text)
 
+    def _check_open(self):
+        '''Raises ValueError once the console has been quit or hidden, like a closed stream'''
+        if self.closed:
+            raise ValueError('I/O operation on a closed console.')
+
+    def _write(self, text):
         if text:
-            x = self._column * self.default_font.font.size('O')[0]
-            try:
-                if self._column * self.STD_ROW_HEIGHT == self._frame[-1].y:
-                    x = frame[-1].x + self.default_font.font.size(self._frame[-1].text[:-1])[0]
-            except:
-                pass
+            self._apply(self._put, text, self.foreground_colour, self.background_colour)
+            self._present_if_due()
+        return len(text)
 
-            self._frame += [CharacterString(text, self.default_font,
-                                           (x, self._row * self.STD_ROW_HEIGHT),
-                                            self.foreground_colour, self._config['antialiasing'])]
-            self._column += len(str(text))
+    def write_ansi(self, data):
+        '''Writes text or bytes containing ANSI escape sequences, in the colours
+        they select. Escape sequences split between calls are kept until the
+        rest arrives. Cursor movement and erasing need the screen_buffer
+        configuration and are ignored otherwise.'''
+        self._check_open()
+        if self._recorder is not None:
+            if isinstance(data, (bytes, bytearray)):
+                self._record('write_ansi_bytes', bytes(data).decode('latin-1'))
+            else:
+                self._record('write_ansi', data)
+        if self._ansi is None:
+            self._ansi = AnsiParser(self._config['default_foreground_colour'],
+                                    self._config['default_background_colour'])
+        for op in self._ansi.feed(data):
+            if op[0] == 'text':
+                self._apply(self._put, op[1], op[2], op[3])
+            elif self.screen is not None:
+                self._apply(self._ansi_control, op, self._ansi.bg)
+        self._present_if_due()
 
-            self._core_update()
+    def _ansi_control(self, op, bg):
+        '''Applies an ANSI cursor movement or erase to the screen buffer'''
+        screen = self.screen
+        left, top = screen.get_cursor_position()
+        left = min(left, screen.columns - 1)
+        if op[0] == 'move':
+            screen.set_cursor_position(min(max(left + op[1], 0), screen.columns - 1),
+                                       min(max(top + op[2], 0), screen.rows - 1))
+        elif op[0] == 'position':
+            screen.set_cursor_position(left if op[1] is None else min(max(op[1], 0), screen.columns - 1),
+                                       top if op[2] is None else min(max(op[2], 0), screen.rows - 1))
+        elif op[0] == 'erase_line' or op[0] == 'erase_display':
+            mode = op[1]
+            if mode == 0:
+                screen.fill(left, top, screen.columns - left, 1, bg=bg)
+            elif mode == 1:
+                screen.fill(0, top, left + 1, 1, bg=bg)
+            else:
+                screen.fill(0, top, screen.columns, 1, bg=bg)
+            if op[0] == 'erase_display':
+                if mode in (0, 2) and top + 1 < screen.rows:
+                    screen.fill(0, top + 1, screen.columns, screen.rows - top - 1, bg=bg)
+                if mode in (1, 2) and top > 0:
+                    screen.fill(0, 0, screen.columns, top, bg=bg)
+
+    def writelines(self, lines):
+        '''Writes each of the lines, which should already end with newlines.'''
+        self.write(''.join(lines))
+
+    def present(self):
+        '''Draws everything written so far to the display.'''
+        if self._recorder is not None:
+            self._record('present')
+        self._core_update()
+
+    def flush(self):
+        '''Presents the output written so far if a frame is due. Unlike present
+        it never waits for the fps clock, so streams can flush after every write.
+        Flushing a closed console, or once the window was closed and pygame
+        has quit, does nothing, so handlers flushed at exit don't fail.'''
+        if self.closed or not pygame.display.get_init():
+            return
+        if self._recorder is not None:
+            self._record('flush')
+        if self._render_thread is not None:
+            return
+        interval = 1 / self._fps if self._fps else 0
+        if monotonic() - self._last_present >= interval:
+            self._core_update(wait=False)
+
+    # Text stream compatibility, so the console can replace sys.stdout or be
+    # given to a logging.StreamHandler
+    encoding = 'utf-8'
+    errors = 'strict'
+    newlines = None
+    closed = False
+
+    def writable(self):
+        return True
+
+    def readable(self):
+        return False
+
+    def seekable(self):
+        return False
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        raise io.UnsupportedOperation('The console does not have a file descriptor.')
+
+    def _unsupported(self, *args):
+        raise io.UnsupportedOperation('The console is a write only stream, key presses are read with read_key.')
+
+    readline = readlines = tell = seek = truncate = detach = _unsupported
+
+    def close(self):
+        '''Closes the stream, later writes raise ValueError. Unlike quit the
+        window stays open, and show opens the stream again.'''
+        self.closed = True
+
+    def __enter__(self):
+        self._check_open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def clear(self):
         '''Clears the display.'''
-        self._frame.clear()
-        self._row = 0
+        if self._recorder is not None:
+            self._record('clear')
+        self._apply(self._clear)
+
+    def _clear(self):
+        if self.screen is not None:
+            self.screen.clear(self.background_colour)
+        self._lines.clear()
+        self._lines.append()
+        self._top = self._lines.first
+        self._top_row = 0
         self._column = 0
+        self._repaint = True
+        self._wraps = {}
+        self._follow = True
+        self._search.clear()
+        self._match = None
+
+    def find(self, pattern, flags=0):
+        '''Finds the newest match of a regular expression in the scrollback,
+        highlights it and scrolls to it. Returns the (line, column) of the match
+        or None if nothing matches.'''
+        if self.screen is not None:
+            raise ConsoleConfigError('Searching is only supported without the screen_buffer configuration.')
+        self._find_pattern = re.compile(pattern, flags)
+        if self._recorder is not None:
+            self._record('find', self._find_pattern.pattern, self._find_pattern.flags)
+        # Whitespace and comments in verbose expressions are not text to look
+        # for, the flags of the compiled pattern include inline (?x)
+        self._find_runs = None
+        if not self._find_pattern.flags & re.VERBOSE:
+            self._find_runs = literals(self._find_pattern.pattern)
+        return self._find_before(self._lines.last, None)
+
+    def find_next(self):
+        '''Finds the next older match of the last find, returns None once there are no more'''
+        if self._find_pattern is None:
+            raise ConsoleError('find must be called before find_next.')
+        if self._recorder is not None:
+            self._record('find_next')
+        if self._match is None:
+            return None
+        line, column = self._match[0], self._match[3]
+        if not column:
+            line, column = line - 1, None
+        return self._find_before(line, column)
+
+    def clear_find(self):
+        '''Removes the highlight of the last match and follows the cursor again'''
+        if self._recorder is not None:
+            self._record('clear_find')
+        self._find_pattern = None
+        self._apply(self._show_match, None)
+        self._follow = True
+        self._present_if_due()
+
+    def _index_lines(self):
+        '''Adds the lines written since the last search to the index, except the cursor line'''
+        index = self._search
+        if index.end < self._lines.first:
+            # Lines were dropped before they were indexed, lines are only added in order
+            index.clear()
+        for line, text in self._lines.lines(max(index.end, self._lines.first), self._lines.last):
+            index.add(line, ''.join(cs.text for cs in text))
+        index.drop_before(self._lines.first)
+
+    def _find_before(self, line, before):
+        '''Searches back from a line for the last match that starts before the
+        text index before, or anywhere on the line if before is None'''
+        self._index_lines()
+        pattern = self._find_pattern
+        found = self._search.candidates(self._find_runs, self._lines.first, line + 1)
+        if found is None:
+            found = range(self._lines.first, line + 1)
+        elif line == self._lines.last:
+            # The cursor line can still change, so it is never indexed
+            found.append(line)
+        for number in reversed(found):
+            text = self._lines[number]
+            joined = ''.join(cs.text for cs in text)
+            match = None
+            for match_ in pattern.finditer(joined):
+                if before is not None and number == line and match_.start() >= before:
+                    break
+                match = match_
+            if match is None:
+                continue
+            columns = [cs.x // self.col_width + i for cs in text for i in range(len(cs.text))]
+            columns.append(columns[-1] + 1 if columns else 0)
+            first = columns[match.start()]
+            end = columns[match.end() - 1] + 1 if match.end() > match.start() else first
+            self._apply(self._show_match, (number, first, end, match.start()))
+            self._present_if_due()
+            return number, first
+        self._apply(self._show_match, None)
+        self._present_if_due()
+        return None
+
+    def _show_match(self, match):
+        '''Highlights a match and scrolls it into view if it isn't shown'''
+        if self._match is not None:
+            self._dirty.add(self._match[0])
+        self._match = match
+        if match is None:
+            return
+        line, first = match[0], match[1]
+        self._dirty.add(line)
+        self._check_write_bounds()
+        # Stay on the match while more text is written
+        self._follow = False
+        columns = self._columns()
+        row = self._column_row(line, first, columns)
+        rows = self._visible_rows()
+        layout = self._layout(rows - (self._canvas.height % self.STD_ROW_HEIGHT != 0), columns)
+        if (line, row) in layout:
+            return
+        # Put the match a third of the way down, without scrolling past the cursor row
+        last = self._lines.last
+        bottom = self._rows_back(last, self._line_rows(last, columns) - 1,
+                                 self._canvas.height // self.STD_ROW_HEIGHT - 1, columns)
+        top = self._rows_back(line, row, rows // 3, columns)
+        self._top, self._top_row = min(top, bottom)
+
+    def _stored_string(self, text, x, col):
+        return CharacterString(text, self.default_font, (x, 0), col, self._config['antialiasing'])
+
+    def export_scrollback(self, path):
+        '''Writes the text of every line in the scrollback to a plain text file,
+        with a scrollback file including the lines from before it was cleared'''
+        with open(path, 'w', encoding='utf-8') as f:
+            for _, text in self._lines.lines(0, self._lines.last + 1):
+                f.write(''.join(cs.text for cs in text) + '\n')
+
+    def set_theme(self, theme):
+        '''Shows every colour in theme, a dict of colours or ConsoleColour
+        names, as the colour it maps to, for text and backgrounds already
+        written too. None shows every colour as written again. With the
+        palette_text configuration text is recoloured by changing palettes,
+        otherwise it is rendered again.'''
+        colours = {}
+        for written, shown in (theme or {}).items():
+            colours[self._rgb(written)] = self._rgb(shown)
+        if self._recorder is not None:
+            # Colours aren't JSON keys, so the theme is recorded as pairs
+            self._record('set_theme', list(colours.items()))
+        self._apply(self._set_theme, colours)
+        self._present_if_due()
+
+    def _set_theme(self, colours):
+        Theme.set(colours, self._config['default_background_colour'])
+        self._display.damaged = True
+
+    def _rgb(self, colour):
+        '''Returns the RGB value of a colour or ConsoleColour name'''
+        if not isinstance(colour, str):
+            return tuple(colour)
+        try:
+            return ConsoleColour.palette()[ConsoleColour.index(colour)]
+        except KeyError:
+            raise ConsoleError('There is no colour named \'' + colour + '\'.')
 
     def beep(self):
         '''Sounds a small alert beep'''
@@ -192,49 +1254,538 @@ class Console:
 
     def read_key(self, wait=True):
         '''Reads a single key from user input'''
-        key = self._display.get_key()
+        key = self._next_char()
         if wait:
             while key is None:
-                self._core_update()
-                key = self._display.get_key()
+                self._core_update(idle=self._idle_ms)
+                key = self._next_char()
+        if self._recorder is not None:
+            self._record('read_key')
         self._core_update()
         return key
 
+    def read_key_event(self, wait=True):
+        '''Reads the next key press as a KeyEvent with its pygame key code,
+        modifiers and text, including keys that type nothing'''
+        event = self._get_key()
+        if wait:
+            while event is None:
+                self._core_update(idle=self._idle_ms)
+                event = self._get_key()
+        if self._recorder is not None:
+            self._record('read_key_event')
+        self._core_update()
+        return event
+
     def read_line(self, for_text=''):
         '''Reads text constantly until 'enter' has been pressed and returns it'''
         self._check_write_bounds()
-        in_char = 0
-        self.write(for_text[:-1])
-        line = self._display.get_line()
-        while not line[1]:
-            self._core_update()
-            line = self._display.get_line()
-            if line[2]:
-                self.write(line[2])
-                in_char += 1
-            if line[3] and in_char > 0:
-                self._frame.pop()
-                in_char -= 1
-                self._column -= 1
-        self._display.reset_get_line()
-        self._row += 1
-        self._column = 0
-        return line[0]
+        self._write(for_text[:-1])
+        chars = []
+        while not self._read_line_keys(chars):
+            self._core_update(idle=self._idle_ms)
+        if self._recorder is not None:
+            self._record('read_line', for_text)
+        self._apply(self._new_line)
+        return ''.join(chars)
+
+    def _next_char(self):
+        '''Takes queued key presses until one that types a character and returns
+        the character, or None once the queue is empty'''
+        event = self._get_key()
+        while event is not None and not (event.unicode and event.unicode.isprintable()):
+            event = self._get_key()
+        return None if event is None else event.unicode
+
+    def _read_line_keys(self, chars):
+        '''Echoes every queued key press into the line being read, returns True
+        once return is pressed, leaving later key presses queued'''
+        event = self._get_key()
+        while event is not None:
+            if event.key in (K_RETURN, K_KP_ENTER):
+                return True
+            if event.key == K_BACKSPACE:
+                if chars:
+                    chars.pop()
+                    self._apply(self._erase_last)
+            elif event.unicode and event.unicode.isprintable():
+                chars.append(event.unicode)
+                self._apply(self._put, event.unicode, self.foreground_colour, self.background_colour)
+            event = self._get_key()
+        return False
+
+    def _get_key(self):
+        '''Takes the oldest queued key press, adding it to the trace when recording'''
+        event = self._display.get_key()
+        if event is not None and self._recorder is not None:
+            self._recorder.record('key', event)
+        return event
+
+    async def _next_frame(self, waiting=False):
+        '''Waits for the next frame interval without blocking the event loop, then
+        completes a frame. Waiting for input with nothing to draw, frames are
+        at least INPUT_POLL_MS apart, so an unlimited fps doesn't spin.'''
+        # Only imported once a coroutine is awaited, asyncio is slow to import
+        # and is already loaded by then
+        import asyncio
+        interval = 1 / self._fps if self._fps else 0
+        if waiting and not self._busy():
+            interval = max(interval, self.INPUT_POLL_MS / 1000)
+        if self._render_thread is not None:
+            await asyncio.sleep(interval)
+            return
+        await asyncio.sleep(max(0, self._last_present + interval - monotonic()))
+        self._core_update(wait=False)
+
+    async def read_key_async(self):
+        '''Awaits a single key from user input'''
+        key = self._next_char()
+        while key is None:
+            await self._next_frame(waiting=True)
+            key = self._next_char()
+        if self._recorder is not None:
+            self._record('read_key')
+        await self._next_frame()
+        return key
+
+    async def read_line_async(self, for_text=''):
+        '''Awaits text until 'enter' has been pressed and returns it'''
+        self._check_write_bounds()
+        self._write(for_text[:-1])
+        chars = []
+        while not self._read_line_keys(chars):
+            await self._next_frame(waiting=True)
+        if self._recorder is not None:
+            self._record('read_line', for_text)
+        self._apply(self._new_line)
+        return ''.join(chars)
+
+    async def sleep_async(self, ms):
+        '''Keeps presenting frames for ms milliseconds without blocking the event loop'''
+        end = monotonic() + ms / 1000
+        while monotonic() < end:
+            await self._next_frame()
+
+    def _erase_last(self):
+        '''Removes the last character written by read_line's echo'''
+        if self.screen is not None:
+            left, top = self.screen.get_cursor_position()
+            if left > 0:
+                self.screen.set_cell(left - 1, top, ' ', bg=self.background_colour)
+                self.screen.set_cursor_position(left - 1, top)
+        elif self._lines[self._lines.last]:
+            # Echoed keys may have been joined into one string, so only drop one character
+            text = self._lines[self._lines.last]
+            cs = text.pop()
+            cs.release()
+            if len(cs.text) > 1:
+                text.append(CharacterString(cs.text[:-1], cs.f, (cs.x, cs.y), cs.col, cs.antialiasing))
+            self._dirty.add(self._lines.last)
+            self._column -= 1
 
     def sleep(self, ms):
-        time = self._display.get_run_time()
-        cur_time = time
-        while cur_time <= time + ms:
-            cur_time = self._display.get_run_time()
-            self._core_update()
+        '''Keeps presenting frames for ms milliseconds, waiting for input between
+        frames that have nothing to draw'''
+        end = monotonic() + ms / 1000
+        remaining = ms
+        while remaining > 0:
+            if self._render_thread is not None:
+                # The render thread presents frames by itself
+                with self._frame_done:
+                    self._frame_done.wait(remaining / 1000)
+            else:
+                self._core_update(idle=max(1, int(remaining)))
+            remaining = (end - monotonic()) * 1000
+
+    def snapshot(self, as_array=False):
+        '''Returns the last presented frame as RGB bytes, row by row, or as a
+        (height, width, 3) NumPy array if as_array is True.'''
+        try:
+            return self._display.snapshot(as_array)
+        except NotImplementedError:
+            raise ConsoleError('NumPy must be installed to take a snapshot as an array.')
+
+    def _record(self, op, *args):
+        '''Adds a call to the trace, with the colours it was made in'''
+        self._recorder.record(op, args, (self.foreground_colour, self.background_colour))
+
+    # Calls in a trace that are replayed by calling the method of the same name
+    REPLAYED = frozenset(['write', 'write_ansi', 'clear', 'set_cursor_position', 'present',
+                          'flush', 'read_key', 'read_key_event', 'read_line', 'scroll_by',
+                          'scroll_to', 'write_at', 'update_line', 'find', 'find_next',
+                          'clear_find'])
+
+    def replay(self, path, speed=1):
+        '''Replays a trace recorded with the record_file configuration. speed 1
+        keeps the recorded timing, 2 replays twice as fast and 0 as fast as
+        possible. Recorded key presses are queued before the reads that took
+        them, so reads return what they returned when recording.'''
+        from pysole.record import read_trace
+        start = monotonic()
+        for entry in read_trace(path):
+            time, op, args = entry[0], entry[1], entry[2:]
+            if speed:
+                # Frames are still presented while waiting for the next call
+                wait = (start + time / speed - monotonic()) * 1000
+                if wait >= 1:
+                    self.sleep(wait)
+            if op == 'colour':
+                self.foreground_colour = tuple(args[0])
+                self.background_colour = tuple(args[1])
+            elif op == 'key':
+                self._display.push_key(KeyEvent(*args))
+            elif op == 'write_ansi_bytes':
+                self.write_ansi(args[0].encode('latin-1'))
+            elif op == 'set_theme':
+                self.set_theme(dict((tuple(written), shown) for written, shown in args[0]))
+            elif op in self.REPLAYED:
+                getattr(self, op)(*args)
+            else:
+                raise ConsoleError('The trace has an unknown call \'' + str(op) + '\'.')
+
+    def _remote_key(self, key, mod, unicode):
+        '''Queues a key press sent by a remote client, called on the server thread'''
+        self._display.push_key(KeyEvent(key, mod, unicode))
+        self._display.wake()
+
+    def _publish(self, changed, repaint, dirty):
+        '''Sends remote clients what changed in the frame just drawn, and the
+        whole buffer to clients that just connected'''
+        remote = self._remote
+        joined = remote.take_joined()
+        if not joined and not remote.watched:
+            return
+        if changed and remote.watched:
+            if repaint:
+                # Cleared, every client starts again
+                messages = self._remote_state()
+            else:
+                messages = self._remote_changes(dirty)
+            if messages:
+                remote.send(messages)
+        if joined:
+            remote.send(self._remote_state(), joined)
+        self._remote_last = self._lines.last
+        self._remote_view = self._remote_view_message()
+        if self.screen is not None:
+            self._remote_shown = self.screen.snapshot()
+
+    def _remote_state(self):
+        '''Messages that give a client the whole buffer'''
+        from pysole.record import TRACE_CONFIG
+        reset = {'op': 'reset', 'config': dict((key, self._config[key]) for key in TRACE_CONFIG)}
+        if self.screen is not None:
+            reset['columns'], reset['rows'] = self.screen.columns, self.screen.rows
+            return [reset, {'op': 'cells', 'rows': self._remote_cells(None)}, self._remote_view_message()]
+        lines = self._lines
+        # A scrollback file is only sent as far back as line_cutoff
+        reset['first'] = first = max(lines.first, lines.last - self._config['line_cutoff'] + 1)
+        return [reset, {'op': 'lines', 'lines': self._remote_lines(range(first, lines.last + 1))},
+                self._remote_view_message()]
+
+    def _remote_changes(self, dirty):
+        '''Messages with the lines or cells that changed since the last frame and the view if it moved'''
+        messages = []
+        if self.screen is not None:
+            rows = self._remote_cells(self._remote_shown)
+            if rows:
+                messages.append({'op': 'cells', 'rows': rows})
+        else:
+            lines = self._lines
+            numbers = set(line for line in dirty if lines.first <= line <= lines.last)
+            numbers.update(range(max(self._remote_last + 1, lines.first), lines.last + 1))
+            if numbers:
+                messages.append({'op': 'lines', 'lines': self._remote_lines(sorted(numbers))})
+        view = self._remote_view_message()
+        if view != self._remote_view:
+            messages.append(view)
+        return messages
+
+    def _remote_lines(self, numbers):
+        '''Line numbers with the x, colour and text of each string on them'''
+        result = []
+        for number in numbers:
+            for line, text in self._lines.lines(number, number + 1):
+                result.append([line, [[cs.x, list(cs.col), cs.text] for cs in text]])
+        return result
+
+    def _remote_cells(self, shown):
+        '''Rows of screen buffer cells that changed since shown, as the row, first
+        column, characters and packed colours'''
+        screen = self.screen
+        rows = []
+        for row, first, end in screen.changes(shown):
+            start = row * screen.columns
+            rows.append([row, first, ''.join(map(chr, screen.chars[start + first:start + end])),
+                         screen.fg[start + first:start + end].tolist(),
+                         screen.bg[start + first:start + end].tolist()])
+        return rows
+
+    def _remote_view_message(self):
+        view = {'op': 'view', 'bg': list(self.background_colour)}
+        if self.screen is None:
+            view.update(top=self._top, row=self._top_row, follow=self._follow)
+        return view
 
     def hide(self):
+        self._set_closed(True)
+        self._stop_render_thread()
         self._display.quit(full_quit=False)
         self._display = None
 
     def show(self):
-        self._display = Display(self.title, self._fps, self.icon)
+        if self._render_thread is not None:
+            # The new render thread creates the display and waits to draw
+            # until the console and panes have been moved onto it
+            self._loop_start.clear()
+            self._start_render_thread()
+        else:
+            self._display = Display(self.title, self._fps, self.icon, headless=self._config['headless'],
+                                    key_queue_size=self._config['key_queue_size'])
+        self.default_font.reload()
+        self._set_closed(False)
+        for view in [self] + self._panes:
+            view._display = self._display
+            view._render_thread = self._render_thread
+            if isinstance(view._canvas, Region):
+                view._canvas.display = self._display
+            else:
+                view._canvas = self._display
+        if self._render_thread is not None:
+            self._loop_start.set()
+
+    def _stop_render_thread(self):
+        '''Ends the render thread once it has finished its frame, if threaded'''
+        if self._render_thread is not None:
+            self._running = False
+            self._display.wake()
+            self._render_thread.join()
+
+    def _set_closed(self, closed):
+        for view in [self] + self._panes:
+            view.closed = closed
 
     def quit(self):
         '''calls the display quit function'''
+        self._set_closed(True)
+        self._stop_render_thread()
+        for view in [self] + self._panes:
+            view._lines.close()
+        if self._recorder is not None:
+            self._recorder.close()
+        if self._remote is not None:
+            self._remote.close()
         self._display.quit()
+
+    def set_region(self, x, y, width, height):
+        '''Draws the console in a rectangle of the window, leaving the rest of
+        the window to panes'''
+        # Layout changes are presented straight away, so in threaded mode the
+        # render thread has applied them before panes are laid out against them
+        self._apply(self._set_region, Region(self._display, (x, y, width, height)))
+        self._core_update()
+
+    def _set_region(self, region):
+        self._canvas = region
+        self._display.damaged = True
+
+    def add_pane(self, x, y, width, height, config=None):
+        '''Adds a pane in a rectangle of the window, which must not overlap the
+        console or other panes. config can change the text settings of the pane,
+        such as its colours, line_cutoff, wrap, screen_buffer or a scrollback_file
+        of its own. record_file, remote and threaded can only be set on the console.'''
+        rect = pygame.Rect(x, y, width, height)
+        for view in [self] + self._panes:
+            if view._canvas.rect.colliderect(rect):
+                raise ConsoleError('Panes can not overlap the console or other panes, '
+                                   'use set_region to make room for them.')
+        pane = Pane(self, rect, config)
+        self._apply(self._panes.append, pane)
+        self._core_update()
+        return pane
+
+    def remove_pane(self, pane):
+        '''Removes a pane, leaving its area of the window empty'''
+        self._apply(self._remove_pane, pane)
+        self._core_update()
+
+    def _remove_pane(self, pane):
+        self._panes.remove(pane)
+        pane._lines.close()
+        self._display.damaged = True
+
+
+class Pane(Console):
+    '''A rectangle of a console's window with its own buffer, cursor, colours
+    and scrolling. Panes are made with Console.add_pane, they are drawn in the
+    console's frames and only redrawn when they change.'''
+    # Window wide settings of the console, which a pane can't have its own of
+    CONSOLE_ONLY = ('record_file', 'remote', 'threaded')
+
+    def __init__(self, parent, rect, config=None):
+        self._parent = parent
+        self._config = dict(parent._config)
+        # A pane keeps its lines in memory unless given a scrollback file of its own
+        self._config.update(scrollback_file=None, record_file=None, remote=None, threaded=False)
+        if config is not None:
+            for key in self.CONSOLE_ONLY:
+                if key in config:
+                    raise ConsoleConfigError('The key \'' + key + '\' can only be set on the console.')
+            scrollback_file = config.get('scrollback_file')
+            if scrollback_file is not None and scrollback_file == parent._config['scrollback_file']:
+                raise ConsoleConfigError('A pane can not share the scrollback file of the console.')
+            self.change_config(config)
+
+        # Everything about the window is shared with the console
+        self._display = parent._display
+        self._canvas = Region(parent._display, rect)
+        self._panes = []
+        self.default_font = parent.default_font
+        self.STD_ROW_HEIGHT = parent.STD_ROW_HEIGHT
+        self.row_height = parent.row_height
+        self.col_width = parent.col_width
+        self.stats = parent.stats
+        self._fps = parent._fps
+        self._idle_ms = parent._idle_ms
+        self._render_thread = parent._render_thread
+        self._frame_done = parent._frame_done
+        self._queue = parent._queue
+        self.run_time = parent.run_time
+        # Only calls made on the console itself are recorded
+        self._recorder = None
+
+        self._init_buffer()
+
+    @property
+    def buffered(self):
+        return self._parent.buffered
+
+    def _apply(self, func, *args):
+        self._parent._apply(self._apply_now, func, args)
+
+    def _apply_now(self, func, args):
+        func(*args)
+        self._changed = True
+
+    def _core_update(self, wait=True, idle=None):
+        self._parent._core_update(wait, idle)
+
+    def _present_if_due(self):
+        self._parent._present_if_due()
+
+    def flush(self):
+        self._parent.flush()
+
+    async def _next_frame(self, waiting=False):
+        await self._parent._next_frame(waiting)
+
+    def set_region(self, x, y, width, height):
+        raise ConsoleError('The region of a pane can not be changed.')
+
+    def add_pane(self, x, y, width, height, config=None):
+        raise ConsoleError('Panes can only be added to the console.')
+
+    def hide(self):
+        self._parent.hide()
+
+    def show(self):
+        self._parent.show()
+
+    def quit(self):
+        self._parent.quit()
+
+
+class RemoteConsole(Console):
+    '''A console that mirrors one served with the remote configuration, from
+    another process or machine. It starts with the served console's text
+    settings, config can change the rest, such as its size or headless. Key
+    presses in its window are sent to the served console.'''
+    def __init__(self, address, config=None, timeout=10):
+        from pysole.remote import RemoteClient
+        self._client = RemoteClient(address)
+        if not self._client.wait(timeout):
+            self._client.close()
+            raise ConsoleError('The remote console at \'' + address + '\' did not send its buffer.')
+        messages = self._client.messages()
+        settings = dict((key, tuple(value) if isinstance(value, list) else value)
+                        for key, value in messages[0]['config'].items())
+        # Frames are drawn as updates arrive rather than per write
+        settings['buffered'] = True
+        if config is not None:
+            settings.update(config)
+        Console.__init__(self, settings)
+        # Line number of the served console that is line 0 here
+        self._base = 0
+        self._client.on_message = self._display.wake
+        for message in messages + self._client.messages():
+            self._apply_remote(message)
+
+    @property
+    def connected(self):
+        return not self._client.closed
+
+    def poll(self):
+        '''Applies the updates received so far, sends key presses and presents
+        a frame. Returns whether still connected.'''
+        self._mirror_step()
+        self._core_update()
+        return self.connected
+
+    def mirror(self):
+        '''Mirrors the served console until it quits, drawing frames only when
+        updates arrive or keys are pressed'''
+        while self._mirror_step():
+            self._core_update(idle=self._idle_ms)
+
+    def _mirror_step(self):
+        for message in self._client.messages():
+            self._apply_remote(message)
+        event = self._display.get_key()
+        while event is not None and self.connected:
+            self._client.send_key(*event)
+            event = self._display.get_key()
+        return self.connected
+
+    def _apply_remote(self, message):
+        '''Changes the buffer as a message from the served console says'''
+        op = message['op']
+        if op == 'reset':
+            self._clear()
+            if 'columns' in message:
+                self.screen = ScreenBuffer(message['columns'], message['rows'],
+                                           self.foreground_colour, self.background_colour)
+            else:
+                self._base = message['first']
+        elif op == 'lines':
+            for number, strings in message['lines']:
+                line = number - self._base
+                if line < self._lines.first:
+                    continue
+                while self._lines.last < line:
+                    self._lines.append()
+                for cs in self._lines[line]:
+                    cs.release()
+                self._lines[line] = [self._stored_string(text, x, tuple(col)) for x, col, text in strings]
+                self._search.change(line)
+                self._dirty.add(line)
+        elif op == 'cells':
+            screen = self.screen
+            for row, first, chars, fg, bg in message['rows']:
+                start = row * screen.columns + first
+                end = start + len(chars)
+                screen.chars[start:end] = array('I', map(ord, chars))
+                screen.fg[start:end] = array('I', fg)
+                screen.bg[start:end] = array('I', bg)
+        elif op == 'view':
+            self.background_colour = tuple(message['bg'])
+            if 'top' in message:
+                self._top, self._top_row = message['top'] - self._base, message['row']
+                self._follow = message['follow']
+        self._changed = True
+
+    def quit(self):
+        self._client.close()
+        Console.quit(self)
+
+
+io.TextIOBase.register(Console)
@@ -0,0 +1,122 @@
+"""Pysole record module.
+
+This module provides the trace files that console sessions are recorded to.
+A console with the record_file configuration adds every write, colour and theme
+change, clear, scroll, search, read and key press it takes to the trace, along
+with when it happened, and Console.replay plays a trace back into another
+console, so sessions can be used as repeatable workloads for benchmarks and to
+reproduce bugs.
+
+Example:
+    $ python3
+    >> from pysole.record import Recorder, read_trace, trace_config
+
+"""
+
+
+import json
+import threading
+from time import monotonic
+
+
+VERSION = 1
+
+# Configuration that changes how the recorded text is laid out and drawn
+TRACE_CONFIG = ('font', 'font_size', 'antialiasing', 'default_width', 'default_height',
+                'default_background_colour', 'default_foreground_colour', 'line_cutoff',
+                'wrap', 'screen_buffer', 'highlight_colour', 'buffered', 'auto_present')
+
+
+class Recorder(object):
+    """Recorder class writes the calls made on a console to a trace file.
+
+    Args:
+        path (str): Location of the trace file, replaced if it already exists
+        config (dict): Configuration of the console being recorded
+
+    Note:
+        The trace is JSON lines. The first line is a header with the version
+        and the configuration in TRACE_CONFIG, every other line is a list of
+        the seconds since recording started, the name of the call and its
+        arguments. Colours are only stored when they change, as a colour entry
+        before the call made in them. Calls can be recorded from any thread.
+
+    """
+    def __init__(self, path, config):
+        self.path = path
+        self._file = open(path, 'w', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._start = monotonic()
+        self._colours = None
+        header = {'version': VERSION,
+                  'config': dict((key, config[key]) for key in TRACE_CONFIG)}
+        self._file.write(json.dumps(header) + '\n')
+
+    def record(self, op, args=(), colours=None):
+        """Adds a call to the trace.
+
+        Args:
+            op (str): Name of the call
+            args (tuple): Arguments of the call, which must be JSON serialisable
+            colours (tuple): The (foreground, background) colours the call
+                was made in, if they matter to it
+
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            time = round(monotonic() - self._start, 4)
+            if colours is not None and colours != self._colours:
+                self._colours = colours
+                self._file.write(json.dumps([time, 'colour', colours[0], colours[1]]) + '\n')
+            self._file.write(json.dumps([time, op] + list(args)) + '\n')
+
+    def close(self):
+        """Writes out the rest of the trace and closes the file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _read_header(trace):
+    header = json.loads(trace.readline() or '{}')
+    if header.get('version') != VERSION:
+        raise ValueError('The file is not a pysole trace of version ' + str(VERSION) + '.')
+    return header
+
+
+def trace_config(path):
+    """Returns the configuration a trace was recorded with, to make a console to replay it in.
+
+    Args:
+        path (str): Location of the trace file
+
+    Returns:
+        dict: The configuration in TRACE_CONFIG, with colours as tuples.
+
+    """
+    with open(path, encoding='utf-8') as trace:
+        config = _read_header(trace)['config']
+    for key, value in config.items():
+        if isinstance(value, list):
+            config[key] = tuple(value)
+    return config
+
+
+def read_trace(path):
+    """Yields the entries of a trace in the order they were recorded.
+
+    Args:
+        path (str): Location of the trace file
+
+    Yields:
+        list: The seconds since recording started, the name of the call and
+            its arguments.
+
+    """
+    with open(path, encoding='utf-8') as trace:
+        _read_header(trace)
+        for line in trace:
+            if line.strip():
+                yield json.loads(line)
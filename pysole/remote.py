@@ -0,0 +1,381 @@
+"""Pysole remote module.
+
+This module provides the sockets a console is watched through from other
+processes. A console with the remote configuration runs a RemoteServer, which
+sends each client the whole text buffer when it connects and after that only
+what changed: lines that were written or changed, screen buffer cells and the
+scroll position. Key presses sent back by clients are added to the console's
+key queue. RemoteClient connects to a server and collects its updates, and
+RemoteConsole in the console module mirrors a console in its own window.
+
+Example:
+    $ python3 -m pysole.remote unix:/tmp/pysole.sock
+
+Note:
+    Addresses are 'unix:' followed by the path of a Unix socket, or
+    'host:port' for TCP. Port 0 picks a free port, the address actually
+    listened on is RemoteServer.address. Messages are JSON objects, one per
+    line, with the kind of message in 'op'.
+
+"""
+
+
+import errno
+import json
+import os
+import selectors
+import socket
+import stat
+import sys
+import threading
+from collections import deque
+
+
+VERSION = 1
+
+
+def parse_address(address):
+    """Returns the socket family and the address to bind or connect to.
+
+    Args:
+        address (str): 'unix:' and a path, or 'host:port'
+
+    Raises:
+        ValueError: If the address is neither.
+
+    """
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError('The address \'' + address + '\' is not unix:path or host:port.')
+    return socket.AF_INET, (host, int(port))
+
+
+def _remove_stale_socket(path):
+    """Removes a Unix socket left behind by a console that did not quit.
+
+    Raises:
+        OSError: If something else is at the path, or a console is still
+            listening on it.
+
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(errno.EEXIST, 'The path \'' + path + '\' exists and is not a socket.')
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, 'A console is already listening on \'' + path + '\'.')
+
+
+def _encode(messages):
+    return ''.join(json.dumps(message, separators=(',', ':')) + '\n'
+                   for message in messages).encode('utf-8')
+
+
+def _decode(buffer, data):
+    """Returns the messages in the complete lines of buffer and data, and the rest."""
+    buffer += data
+    lines = buffer.split(b'\n')
+    return [json.loads(line) for line in lines[:-1] if line.strip()], lines[-1]
+
+
+class _Client(object):
+    # Connection state of a client, owned by the server thread apart from out
+    __slots__ = ('out', 'partial', 'ready', 'dropped')
+
+    def __init__(self):
+        self.out = bytearray()
+        self.partial = b''
+        self.ready = False
+        self.dropped = False
+
+
+class RemoteServer(object):
+    """RemoteServer class sends a console's updates to the clients connected to a socket.
+
+    Args:
+        address (str): Address to listen on
+        on_key (function): Called with the key, modifiers and text of each key
+            press a client sends, on the server thread
+        on_join (function): Called on the server thread when a client connects,
+            so the console can send it the buffer
+
+    Attributes:
+        address (str): The address listened on
+
+    Raises:
+        OSError: If the address is in use. A Unix socket left behind by a
+            console that did not quit is replaced, anything else at the path
+            is left alone.
+
+    Note:
+        A server thread accepts clients, reads their key presses and writes
+        out what send queued for them, so a slow client never holds up
+        drawing. A client that falls more than MAX_BUFFER bytes behind is
+        disconnected.
+
+    """
+    MAX_BUFFER = 16 * 1024 * 1024
+
+    def __init__(self, address, on_key, on_join=None):
+        self.on_key = on_key
+        self.on_join = on_join
+        family, target = parse_address(address)
+        self._path = None
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_UNIX:
+            _remove_stale_socket(target)
+            self._path = target
+            self._listener.bind(target)
+            self.address = 'unix:' + target
+        else:
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._listener.bind(target)
+            self.address = '%s:%d' % self._listener.getsockname()[:2]
+        self._listener.listen()
+        self._listener.setblocking(False)
+
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._joined = []
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        # Written to when there is output to send, to wake the server thread
+        self._wake_read, self._wake_write = socket.socketpair()
+        self._wake_read.setblocking(False)
+        self._wake_write.setblocking(False)
+        self._selector.register(self._wake_read, selectors.EVENT_READ)
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, name='pysole-remote', daemon=True)
+        self._thread.start()
+
+    @property
+    def watched(self):
+        """bool: Whether any client has been sent the buffer."""
+        with self._lock:
+            return any(client.ready for client in self._clients.values())
+
+    def take_joined(self):
+        """Returns the clients that connected since the last call, which need the whole buffer."""
+        with self._lock:
+            joined, self._joined = self._joined, []
+        return joined
+
+    def send(self, messages, clients=None):
+        """Queues messages for clients.
+
+        Args:
+            messages (list): The messages, dicts that are JSON serialisable
+            clients (list): Clients from take_joined, which from then on are
+                sent every message, or None for every client sent the buffer
+
+        """
+        data = _encode(messages)
+        wake = False
+        with self._lock:
+            if clients is None:
+                clients = [sock for sock, client in self._clients.items() if client.ready]
+            for sock in clients:
+                client = self._clients.get(sock)
+                if client is None or client.dropped:
+                    continue
+                # The server thread is already writing out clients with output
+                wake = wake or not client.out
+                client.ready = True
+                client.out += data
+                if len(client.out) > self.MAX_BUFFER:
+                    client.dropped = True
+                    client.out = bytearray()
+        if wake:
+            self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_write.send(b'\0')
+        except (BlockingIOError, OSError):
+            # Already woken, or closing
+            pass
+
+    def _serve(self):
+        while self._running:
+            with self._lock:
+                clients = list(self._clients.items())
+            for sock, client in clients:
+                if client.dropped:
+                    self._drop(sock)
+                    continue
+                events = selectors.EVENT_READ
+                if client.out:
+                    events |= selectors.EVENT_WRITE
+                self._selector.modify(sock, events)
+            for key, events in self._selector.select():
+                sock = key.fileobj
+                if sock is self._listener:
+                    self._accept()
+                elif sock is self._wake_read:
+                    try:
+                        while self._wake_read.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                else:
+                    try:
+                        if events & selectors.EVENT_READ:
+                            self._read(sock)
+                        if events & selectors.EVENT_WRITE and sock in self._clients:
+                            with self._lock:
+                                client = self._clients[sock]
+                                sent = sock.send(client.out)
+                                del client.out[:sent]
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    except (OSError, ValueError):
+                        self._drop(sock)
+
+    def _accept(self):
+        try:
+            sock, _ = self._listener.accept()
+        except (BlockingIOError, OSError):
+            return
+        sock.setblocking(False)
+        with self._lock:
+            self._clients[sock] = _Client()
+            self._joined.append(sock)
+        self._selector.register(sock, selectors.EVENT_READ)
+        if self.on_join is not None:
+            self.on_join()
+
+    def _read(self, sock):
+        data = sock.recv(65536)
+        if not data:
+            self._drop(sock)
+            return
+        client = self._clients[sock]
+        messages, client.partial = _decode(client.partial, data)
+        for message in messages:
+            if message.get('op') == 'key':
+                self.on_key(message['key'], message['mod'], message['unicode'])
+
+    def _drop(self, sock):
+        with self._lock:
+            self._clients.pop(sock, None)
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        sock.close()
+
+    def close(self):
+        """Disconnects every client and stops listening."""
+        self._running = False
+        self._wake()
+        self._thread.join()
+        for sock in list(self._clients):
+            self._drop(sock)
+        self._selector.close()
+        self._listener.close()
+        self._wake_read.close()
+        self._wake_write.close()
+        if self._path is not None and os.path.exists(self._path):
+            os.unlink(self._path)
+
+
+class RemoteClient(object):
+    """RemoteClient class connects to a RemoteServer and collects its messages.
+
+    Args:
+        address (str): Address the server listens on
+        on_message (function): Called on the reading thread when messages arrive
+
+    Attributes:
+        closed (bool): Whether the server closed the connection
+        on_message (function): Called on the reading thread when messages arrive
+
+    """
+    def __init__(self, address, on_message=None):
+        family, target = parse_address(address)
+        self.on_message = on_message
+        self.closed = False
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.connect(target)
+        self._messages = deque()
+        self._arrived = threading.Condition()
+        self._thread = threading.Thread(target=self._receive, name='pysole-remote-client', daemon=True)
+        self._thread.start()
+
+    def _receive(self):
+        partial = b''
+        while True:
+            try:
+                data = self._sock.recv(65536)
+            except OSError:
+                data = b''
+            if data:
+                messages, partial = _decode(partial, data)
+            with self._arrived:
+                if not data:
+                    self.closed = True
+                else:
+                    self._messages.extend(messages)
+                self._arrived.notify_all()
+            if self.on_message is not None:
+                self.on_message()
+            if not data:
+                return
+
+    def wait(self, timeout=None):
+        """Waits until there are messages to take or the connection is closed.
+
+        Returns:
+            bool: Whether there are messages to take.
+
+        """
+        with self._arrived:
+            self._arrived.wait_for(lambda: self._messages or self.closed, timeout)
+            return bool(self._messages)
+
+    def messages(self):
+        """Returns every message that arrived since the last call."""
+        with self._arrived:
+            messages = list(self._messages)
+            self._messages.clear()
+        return messages
+
+    def send_key(self, key, mod, unicode):
+        """Sends a key press to the console."""
+        self._sock.sendall(_encode([{'op': 'key', 'key': key, 'mod': mod, 'unicode': unicode}]))
+
+    def close(self):
+        """Disconnects from the server."""
+        try:
+            # Wakes the reading thread, which close alone does not
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+
+def main(argv=None):
+    """Mirrors the console at the address given on the command line in a window."""
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        sys.stderr.write('usage: python3 -m pysole.remote ADDRESS\n')
+        return 2
+    # The console module uses this one, so it is only imported when mirroring
+    from pysole.console import RemoteConsole
+    RemoteConsole(argv[0]).mirror()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
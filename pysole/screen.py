@@ -0,0 +1,198 @@
+"""Pysole screen module.
+
+This module provides a character cell screen buffer like the one behind a
+.NET console. The buffer is a grid of columns and rows where every cell has a
+character, a foreground colour and a background colour, and text is written
+at a cursor that can be moved with set_cursor_position.
+
+Cells are kept in compact arrays of unsigned ints, one for the codepoints and
+one for each of the colours packed as 0xRRGGBB, so whole rows can be copied,
+filled and compared at once.
+
+Example:
+    $ python3
+    >> from pysole.screen import ScreenBuffer
+
+"""
+
+
+from array import array
+
+
+def pack_colour(col):
+    """Packs an RGB tuple into a single int."""
+    return (col[0] << 16) | (col[1] << 8) | col[2]
+
+
+def unpack_colour(value):
+    """Unpacks an int made by pack_colour back into an RGB tuple."""
+    return (value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF
+
+
+class ScreenBuffer(object):
+    """ScreenBuffer class is a grid of character cells with a cursor.
+
+    Args:
+        columns (int): Width of the buffer in cells
+        rows (int): Height of the buffer in cells
+        fg (int tuple): The colour the cells' text starts as
+        bg (int tuple): The colour the cells' background starts as
+
+    Attributes:
+        columns (int): Width of the buffer in cells
+        rows (int): Height of the buffer in cells
+        chars (array): Codepoint of every cell, row by row
+        fg (array): Packed foreground colour of every cell
+        bg (array): Packed background colour of every cell
+        cursor_left (int): Column the next character is written to
+        cursor_top (int): Row the next character is written to
+
+    """
+    def __init__(self, columns, rows, fg=(255, 255, 255), bg=(0, 0, 0)):
+        if columns < 1 or rows < 1:
+            raise ValueError('A screen buffer needs at least one row and column.')
+        self.columns = columns
+        self.rows = rows
+        self.chars = array('I', [ord(' ')]) * (columns * rows)
+        self.fg = array('I', [pack_colour(fg)]) * (columns * rows)
+        self.bg = array('I', [pack_colour(bg)]) * (columns * rows)
+        self.cursor_left = 0
+        self.cursor_top = 0
+
+    def contains(self, left, top):
+        """Returns whether a column and row is inside the buffer."""
+        return 0 <= left < self.columns and 0 <= top < self.rows
+
+    def _check(self, left, top):
+        if not self.contains(left, top):
+            raise ValueError('Position (' + str(left) + ', ' + str(top) + ') is outside the buffer.')
+
+    def set_cursor_position(self, left, top):
+        """Moves the cursor to a column and row."""
+        self._check(left, top)
+        self.cursor_left = left
+        self.cursor_top = top
+
+    def get_cursor_position(self):
+        """Returns the cursor's (column, row)."""
+        return self.cursor_left, self.cursor_top
+
+    def get_cell(self, left, top):
+        """Returns the (character, foreground, background) of a cell."""
+        self._check(left, top)
+        i = top * self.columns + left
+        return chr(self.chars[i]), unpack_colour(self.fg[i]), unpack_colour(self.bg[i])
+
+    def set_cell(self, left, top, char, fg=None, bg=None):
+        """Sets a cell's character, and its colours if given."""
+        self._check(left, top)
+        i = top * self.columns + left
+        self.chars[i] = ord(char)
+        if fg is not None:
+            self.fg[i] = pack_colour(fg)
+        if bg is not None:
+            self.bg[i] = pack_colour(bg)
+
+    def _line_feed(self, bg):
+        self.cursor_left = 0
+        if self.cursor_top >= self.rows - 1:
+            self.scroll(1, bg=bg)
+        else:
+            self.cursor_top += 1
+
+    def write(self, text, fg, bg):
+        """Writes text at the cursor, wrapping after the last column and
+        scrolling the buffer up when a line feed happens on the last row."""
+        packed_fg = pack_colour(fg)
+        packed_bg = pack_colour(bg)
+        for char in text:
+            if char == '\n':
+                self._line_feed(bg)
+            elif char == '\r':
+                self.cursor_left = 0
+            else:
+                if self.cursor_left >= self.columns:
+                    self._line_feed(bg)
+                i = self.cursor_top * self.columns + self.cursor_left
+                self.chars[i] = ord(char)
+                self.fg[i] = packed_fg
+                self.bg[i] = packed_bg
+                self.cursor_left += 1
+
+    def fill(self, left, top, width, height, char=' ', fg=None, bg=None):
+        """Fills a region with a character, and with colours if given."""
+        width = min(width, self.columns - left)
+        height = min(height, self.rows - top)
+        if width < 1 or height < 1:
+            return
+        self._check(left, top)
+        values = [(self.chars, ord(char))]
+        if fg is not None:
+            values.append((self.fg, pack_colour(fg)))
+        if bg is not None:
+            values.append((self.bg, pack_colour(bg)))
+        for cells, value in values:
+            run = array('I', [value]) * width
+            for row in range(top, top + height):
+                start = row * self.columns + left
+                cells[start:start + width] = run
+
+    def copy(self, left, top, width, height, target_left, target_top):
+        """Copies a region of cells so its top left is at the target position.
+        Overlapping regions are copied as they were before the copy."""
+        width = min(width, self.columns - left, self.columns - target_left)
+        height = min(height, self.rows - top, self.rows - target_top)
+        if width < 1 or height < 1:
+            return
+        self._check(left, top)
+        self._check(target_left, target_top)
+        for cells in (self.chars, self.fg, self.bg):
+            source = [cells[(top + row) * self.columns + left:(top + row) * self.columns + left + width]
+                      for row in range(height)]
+            for row, run in enumerate(source):
+                start = (target_top + row) * self.columns + target_left
+                cells[start:start + width] = run
+
+    def scroll(self, lines=1, top=0, bottom=None, bg=None):
+        """Scrolls the rows from top up to bottom by a number of lines, up if
+        positive and down if negative. Rows scrolled in are blank."""
+        bottom = self.rows if bottom is None else bottom
+        height = bottom - top
+        if abs(lines) >= height:
+            self.fill(0, top, self.columns, height, bg=bg)
+        elif lines > 0:
+            self.copy(0, top + lines, self.columns, height - lines, 0, top)
+            self.fill(0, bottom - lines, self.columns, lines, bg=bg)
+        elif lines < 0:
+            self.copy(0, top, self.columns, height + lines, 0, top - lines)
+            self.fill(0, top, self.columns, -lines, bg=bg)
+
+    def clear(self, bg=None):
+        """Blanks every cell and moves the cursor to the top left."""
+        self.fill(0, 0, self.columns, self.rows, bg=bg)
+        self.cursor_left = 0
+        self.cursor_top = 0
+
+    def snapshot(self):
+        """Returns a copy of the cells to compare against later with changes."""
+        return array('I', self.chars), array('I', self.fg), array('I', self.bg)
+
+    def changes(self, previous=None):
+        """Yields (row, first column, end column) for the run of cells in each
+        row that differs from a snapshot, or for every row if there is none.
+
+        Rows are compared as whole slices, so unchanged rows cost very little.
+        """
+        columns = self.columns
+        current = (self.chars, self.fg, self.bg)
+        for row in range(self.rows):
+            start = row * columns
+            end = start + columns
+            if previous is None:
+                yield row, 0, columns
+                continue
+            if all(cells[start:end] == old[start:end] for cells, old in zip(current, previous)):
+                continue
+            changed = [i for i in range(columns)
+                       if any(cells[start + i] != old[start + i] for cells, old in zip(current, previous))]
+            yield row, changed[0], changed[-1] + 1
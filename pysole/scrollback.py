@@ -0,0 +1,245 @@
+"""Pysole scrollback module.
+
+This module provides the line buffers used by the console to store text that
+has been written. Lines are addressed by an absolute line number that keeps
+counting up for the life of the buffer, so the console can scroll by moving a
+viewport over line numbers instead of moving text.
+
+Scrollback keeps a fixed amount of lines in memory, DiskScrollback keeps every
+line in a file and only loads the lines that are asked for.
+
+Example:
+    $ python3
+    >> from pysole.scrollback import Scrollback
+
+"""
+
+
+import mmap
+import os
+import struct
+from array import array
+from collections import OrderedDict
+
+from pysole.screen import pack_colour, unpack_colour
+
+
+class Scrollback(object):
+    """Scrollback class is a ring buffer of lines with a fixed capacity.
+
+    Args:
+        capacity (int): The maximum amount of lines kept in the buffer.
+
+    Attributes:
+        capacity (int): The maximum amount of lines kept in the buffer.
+
+    Note:
+        Appending a line once the buffer is full overwrites the oldest line,
+        so trimming costs nothing. Each line is a list of the CharacterStrings
+        written on that line.
+
+    """
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError('Scrollback capacity must be at least 1.')
+        self.capacity = int(capacity)
+        self._lines = [None] * self.capacity
+        # Absolute line number of the oldest line and one past the newest
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, line):
+        if not self._start <= line < self._end:
+            raise IndexError('Line ' + str(line) + ' is not in the scrollback.')
+        return self._lines[line % self.capacity]
+
+    def __setitem__(self, line, value):
+        if not self._start <= line < self._end:
+            raise IndexError('Line ' + str(line) + ' is not in the scrollback.')
+        self._lines[line % self.capacity] = value
+
+    @property
+    def first(self):
+        """int: Line number of the oldest line still in the buffer."""
+        return self._start
+
+    @property
+    def last(self):
+        """int: Line number of the newest line, -1 if the buffer is empty."""
+        return self._end - 1
+
+    def append(self, line=None):
+        """Adds a line to the end of the buffer, dropping the oldest line if full.
+
+        Returns:
+            int: Line number of the new line.
+
+        """
+        self._lines[self._end % self.capacity] = [] if line is None else line
+        self._end += 1
+        if self._end - self._start > self.capacity:
+            self._start += 1
+        return self._end - 1
+
+    def lines(self, start, stop):
+        """Yields (line number, line) for lines in the range that are in the buffer."""
+        for line in range(max(start, self._start), min(stop, self._end)):
+            yield line, self._lines[line % self.capacity]
+
+    def clear(self):
+        """Removes every line, line numbers start again from 0."""
+        self._lines = [None] * self.capacity
+        self._start = 0
+        self._end = 0
+
+    def close(self):
+        pass
+
+
+class DiskScrollback(object):
+    """DiskScrollback class keeps every line in an append only file.
+
+    Args:
+        path (str): Location of the file, the line index is kept next to it
+            with '.idx' added to the name
+        make_string (function): Makes a CharacterString from the text, x
+            position and colour of a stored string
+
+    Attributes:
+        path (str): Location of the file
+
+    Note:
+        Only the newest line, which can still be written to, is kept in memory.
+        Older lines are read back through mmap using the index of where each
+        line starts, so any line is found in constant time, and the most
+        recently read lines are kept decoded. Opening an existing file carries
+        on after the lines already in it. Clearing keeps the stored lines in
+        the file, lines before first can still be read.
+
+    """
+    CACHE_LINES = 1024
+
+    _LINE = struct.Struct('<I')
+    _STRING = struct.Struct('<III')
+
+    def __init__(self, path, make_string):
+        self.path = path
+        self._make_string = make_string
+        self._data = open(path, 'a+b')
+        self._index = open(path + '.idx', 'a+b')
+        self._index.seek(0)
+        self._offsets = array('Q')
+        self._offsets.frombytes(self._index.read())
+        self._data.seek(0, os.SEEK_END)
+        self._size = self._data.tell()
+        self._map = None
+        self._mapped = 0
+        self._current = None
+        self._cache = OrderedDict()
+        self._first = 0
+
+    def __len__(self):
+        return len(self._offsets) + (self._current is not None)
+
+    def __getitem__(self, line):
+        if line == len(self._offsets) and self._current is not None:
+            return self._current
+        if not 0 <= line < len(self._offsets):
+            raise IndexError('Line ' + str(line) + ' is not in the scrollback.')
+        text = self._cache.get(line)
+        if text is None:
+            text = self._cache[line] = self._read(line)
+            if len(self._cache) > self.CACHE_LINES:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(line)
+        return text
+
+    def __setitem__(self, line, value):
+        if line != len(self._offsets) or self._current is None:
+            raise IndexError('Only the newest line in the scrollback can be changed.')
+        self._current = value
+
+    @property
+    def first(self):
+        """int: Line number of the oldest line since the last clear, as no lines are dropped."""
+        return self._first
+
+    @property
+    def last(self):
+        """int: Line number of the newest line, -1 if the buffer is empty."""
+        return len(self) - 1
+
+    def append(self, line=None):
+        """Stores the newest line in the file and adds a new line after it.
+
+        Returns:
+            int: Line number of the new line.
+
+        """
+        if self._current is not None:
+            self._write(self._current)
+        self._current = [] if line is None else line
+        return len(self._offsets)
+
+    def lines(self, start, stop):
+        """Yields (line number, line) for lines in the range, without caching them."""
+        for line in range(max(start, 0), min(stop, len(self))):
+            if line == len(self._offsets):
+                yield line, self._current
+            else:
+                yield line, self._read(line)
+
+    def _write(self, text):
+        parts = [self._LINE.pack(len(text))]
+        for cs in text:
+            encoded = str(cs.text).encode('utf-8')
+            parts.append(self._STRING.pack(cs.x, pack_colour(cs.col), len(encoded)))
+            parts.append(encoded)
+        record = b''.join(parts)
+        self._offsets.append(self._size)
+        self._index.write(self._offsets[-1:].tobytes())
+        self._data.write(record)
+        self._size += len(record)
+
+    def _read(self, line):
+        end = self._offsets[line + 1] if line + 1 < len(self._offsets) else self._size
+        if end > self._mapped:
+            # The file has grown past what is mapped, so map it again
+            self._data.flush()
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped = len(self._map)
+        offset = self._offsets[line]
+        count, = self._LINE.unpack_from(self._map, offset)
+        offset += self._LINE.size
+        text = []
+        for _ in range(count):
+            x, col, length = self._STRING.unpack_from(self._map, offset)
+            offset += self._STRING.size
+            text.append(self._make_string(self._map[offset:offset + length].decode('utf-8'),
+                                          x, unpack_colour(col)))
+            offset += length
+        return text
+
+    def clear(self):
+        """Stores the newest line and starts again after it, keeping every line in the file."""
+        if self._current is not None:
+            self._write(self._current)
+            self._current = None
+        self._first = len(self._offsets)
+
+    def close(self):
+        """Stores the newest line and closes the file."""
+        if self._current is not None:
+            self._write(self._current)
+            self._current = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._data.close()
+        self._index.close()
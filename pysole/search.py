@@ -0,0 +1,207 @@
+"""Pysole search module.
+
+This module provides the index the console uses to search its scrollback. The
+text every match of a regular expression must contain is worked out from the
+expression, and the index narrows a search down to the lines that could hold
+that text, so only those lines are searched with the expression.
+
+Example:
+    $ python3
+    >> from pysole.search import SearchIndex, literals
+
+"""
+
+
+# Escapes that match a class of characters or a position instead of a character
+_CLASS_ESCAPES = set('dDwWsSbBAZ')
+_LITERAL_ESCAPES = {'a': '\a', 'n': '\n', 't': '\t', 'r': '\r', 'f': '\f', 'v': '\v'}
+
+
+def literals(pattern):
+    """Returns runs of text that every match of a regular expression must contain.
+
+    Args:
+        pattern (str): The regular expression
+
+    Returns:
+        list: Strings found in every match, empty if nothing is certain, such
+            as when the expression has alternatives at its top level.
+
+    """
+    # Each open group has its finished runs, the run being read and whether it can be skipped
+    groups = [[[], '', False]]
+    i = 0
+    while i < len(pattern):
+        group = groups[-1]
+        char = pattern[i]
+        i += 1
+        if char == '\\' and i < len(pattern):
+            escaped = pattern[i]
+            i += 1
+            if escaped in _CLASS_ESCAPES:
+                group[0].append(group[1])
+                group[1] = ''
+            elif escaped.isalnum() and escaped not in _LITERAL_ESCAPES:
+                # Character codes, named characters, octal escapes and
+                # backreferences are not worked out, so nothing is certain
+                return []
+            else:
+                group[1] += _LITERAL_ESCAPES.get(escaped, escaped)
+        elif char in '*?{':
+            # The last character is optional, so the run ends before it
+            group[0].append(group[1][:-1])
+            group[1] = ''
+            if char == '{':
+                close = pattern.find('}', i)
+                i = len(pattern) if close == -1 else close + 1
+        elif char == '+':
+            group[0].append(group[1])
+            group[1] = ''
+        elif char == '[':
+            group[0].append(group[1])
+            group[1] = ''
+            i = _set_end(pattern, i) + 1
+        elif char == '(':
+            group[0].append(group[1])
+            group[1] = ''
+            # Lookarounds, conditionals and flags are not required text, unlike (?:...)
+            optional = pattern.startswith('?', i) and not pattern.startswith('?:', i)
+            if pattern.startswith('?:', i):
+                i += 2
+            groups.append([[], '', optional])
+        elif char == ')' and len(groups) > 1:
+            runs, run, optional = groups.pop()
+            runs.append(run)
+            if i < len(pattern) and pattern[i] in '*?{':
+                optional = True
+            parent = groups[-1]
+            if not optional:
+                parent[0].extend(runs)
+        elif char == '|':
+            # Only text on every alternative is certain, which isn't worked out
+            group[0] = []
+            group[1] = ''
+            group[2] = True
+            close = _group_end(pattern, i)
+            i = close
+        elif char in '.^$':
+            group[0].append(group[1])
+            group[1] = ''
+        else:
+            group[1] += char
+    runs, run, optional = groups[0]
+    if optional:
+        return []
+    runs.append(run)
+    return [run for run in runs if run]
+
+
+def _group_end(pattern, i):
+    """Returns the position of the ) closing the group i is in, or the end of the pattern."""
+    depth = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            i += 1
+        elif char == '[':
+            i = _set_end(pattern, i + 1)
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            if depth == 0:
+                return i
+            depth -= 1
+        i += 1
+    return len(pattern)
+
+
+def _set_end(pattern, i):
+    """Returns the position of the ] closing the character set that starts at i."""
+    # A ] straight after the opening bracket is part of the set
+    if pattern.startswith('^', i):
+        i += 1
+    if pattern.startswith(']', i):
+        i += 1
+    while i < len(pattern) and pattern[i] != ']':
+        i += 2 if pattern[i] == '\\' else 1
+    return i
+
+
+class SearchIndex(object):
+    """SearchIndex class keeps the scrollback text in blocks to narrow down searches.
+
+    Attributes:
+        start (int): Line number of the oldest line still in the index
+        end (int): Line number after the newest line in the index
+
+    Note:
+        Lines must be added in order. Every BLOCK_LINES lines are joined into
+        one lower case block, and a search only looks at the lines of blocks
+        that contain all of the text its matches must contain, which is found
+        with one substring test per block. Blocks are lower case, so the lines
+        found for a case sensitive search are a superset of the matches and
+        still need to be searched with the expression. Lines changed after they
+        were added can't be narrowed down, so they are always searched.
+
+    """
+    BLOCK_LINES = 64
+
+    def __init__(self):
+        self.clear()
+
+    def add(self, line, text):
+        """Adds the text of the line after the newest line in the index."""
+        if self.end == self.start:
+            self.start = self.end = line
+        self._pending.append(text)
+        self.end += 1
+        if len(self._pending) == self.BLOCK_LINES:
+            self._blocks.append('\n'.join(self._pending).lower())
+            self._pending = []
+
+    def candidates(self, runs, start, stop):
+        """Returns the sorted line numbers in the range that may contain every run of text.
+
+        Returns:
+            list: Line numbers, or None if there are no runs to narrow down by.
+
+        """
+        if not runs:
+            return None
+        runs = [run.lower() for run in runs]
+        size = self.BLOCK_LINES
+        found = []
+        first = max(0, (start - self.start) // size)
+        last = min(len(self._blocks), -(-(stop - self.start) // size))
+        for block in range(first, last):
+            text = self._blocks[block]
+            if all(run in text for run in runs):
+                line = self.start + block * size
+                found.extend(range(max(line, start), min(line + size, stop)))
+        line = self.start + len(self._blocks) * size
+        text = '\n'.join(self._pending).lower()
+        if line < stop and all(run in text for run in runs):
+            found.extend(range(max(line, start), min(self.end, stop)))
+        if self._changed:
+            found = sorted(set(found).union(line for line in self._changed if start <= line < stop))
+        return found
+
+    def change(self, line):
+        """Marks a line in the index whose text has changed since it was added."""
+        self._changed.add(line)
+
+    def drop_before(self, line):
+        """Forgets the blocks that only hold lines before a line number."""
+        blocks = min(len(self._blocks), max(0, (line - self.start) // self.BLOCK_LINES))
+        if blocks:
+            del self._blocks[:blocks]
+            self.start += blocks * self.BLOCK_LINES
+            self._changed = set(line for line in self._changed if line >= self.start)
+
+    def clear(self):
+        """Removes every line from the index."""
+        self._blocks = []
+        self._pending = []
+        self._changed = set()
+        self.start = 0
+        self.end = 0
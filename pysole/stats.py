@@ -0,0 +1,118 @@
+"""Pysole stats module.
+
+This module provides the frame statistics the console collects when the stats
+configuration is enabled. Every frame records how long each phase took and
+counts the work it did, and the last frames are kept so rolling averages and
+percentiles can be worked out to find where the time goes.
+
+Example:
+    $ python3
+    >> from pysole.stats import FrameStats
+
+"""
+
+
+from collections import deque
+from time import perf_counter
+
+
+class FrameStats(object):
+    """FrameStats class collects the timings and counters of each frame.
+
+    Args:
+        window (int): How many of the last frames are kept for the rolling stats
+
+    Attributes:
+        frame (dict): Timings in seconds and counters of the frame being drawn
+        totals (dict): Counters added up over every frame
+        frames (int): The amount of frames completed
+
+    Note:
+        The phases of a frame are
+        events, handling pygame events,
+        wait, sleeping for the fps limit or waiting for input,
+        draw, drawing everything that changed, which includes
+        fill, filling backgrounds,
+        blit, blitting text and
+        render, rasterising text with the font,
+        update, pushing the drawn rects to the window and
+        frame, the whole frame apart from the wait.
+        The counters are fills, blits, renders, lines, the rows of text or
+        cells that were redrawn, and surface_bytes, the size of the rendered
+        text surfaces kept at the end of the frame.
+
+    """
+    PHASES = ('events', 'wait', 'draw', 'fill', 'blit', 'render', 'update', 'frame')
+    COUNTERS = ('fills', 'blits', 'renders', 'lines', 'surface_bytes')
+
+    def __init__(self, window=240):
+        self.window = window
+        self.callbacks = []
+        self.reset()
+
+    def reset(self):
+        """Forgets every frame collected so far."""
+        self.frame = dict.fromkeys(self.PHASES + self.COUNTERS, 0)
+        self.totals = dict.fromkeys(self.COUNTERS, 0)
+        self.frames = 0
+        self._history = dict((name, deque(maxlen=self.window))
+                             for name in self.PHASES + self.COUNTERS)
+        self._ends = deque(maxlen=self.window)
+
+    def add(self, name, value):
+        """Adds time in seconds or a count to a phase or counter of the current frame."""
+        self.frame[name] += value
+
+    def end_frame(self):
+        """Completes the current frame, passes it to every callback and starts the next one."""
+        frame = self.frame
+        for name, value in frame.items():
+            self._history[name].append(value)
+        for name in self.COUNTERS:
+            if name != 'surface_bytes':
+                self.totals[name] += frame[name]
+        self.totals['surface_bytes'] = frame['surface_bytes']
+        self.frames += 1
+        self._ends.append(perf_counter())
+        self.frame = dict.fromkeys(self.PHASES + self.COUNTERS, 0)
+        for callback in self.callbacks:
+            callback(frame)
+
+    @property
+    def fps(self):
+        """float: Frames per second over the rolling window."""
+        if len(self._ends) < 2 or self._ends[-1] == self._ends[0]:
+            return 0.0
+        return (len(self._ends) - 1) / (self._ends[-1] - self._ends[0])
+
+    def mean(self, name):
+        """Returns the mean of a phase or counter over the rolling window."""
+        values = self._history[name]
+        return sum(values) / len(values) if values else 0
+
+    def percentile(self, name, percent):
+        """Returns a percentile, from 0 to 100, of a phase or counter over the rolling window."""
+        values = sorted(self._history[name])
+        if not values:
+            return 0
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+    def summary(self):
+        """Returns the fps, the mean, median, 95th and 99th percentile and
+        maximum of every phase in ms, and the counters of the last frame and
+        of every frame, as a dict."""
+        phases = {}
+        for name in self.PHASES:
+            values = self._history[name]
+            phases[name] = {'mean': self.mean(name) * 1000,
+                            'p50': self.percentile(name, 50) * 1000,
+                            'p95': self.percentile(name, 95) * 1000,
+                            'p99': self.percentile(name, 99) * 1000,
+                            'max': max(values) * 1000 if values else 0}
+        last = dict((name, self._history[name][-1] if self._history[name] else 0)
+                    for name in self.COUNTERS)
+        return {'frames': self.frames,
+                'fps': self.fps,
+                'phases': phases,
+                'last': last,
+                'totals': dict(self.totals)}
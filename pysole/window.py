@@ -15,8 +15,13 @@ Todo:
 """
 
 
+import os
+from collections import OrderedDict, deque, namedtuple
+from time import perf_counter
+
 import pygame
-from pygame.locals import *
+from pygame.locals import (DOUBLEBUF, HWSURFACE, KEYDOWN, K_PAGEDOWN, K_PAGEUP, MOUSEWHEEL, QUIT,
+                           RESIZABLE, SRCALPHA, VIDEORESIZE)
 from sys import exit
 
 
@@ -30,15 +35,351 @@ class Font(object):
     Attributes:
         font (pygame.font.Font): Font created from font location and size.
         size (int): Font size
+        monospace (bool): Whether every glyph has the same advance
+        advance (int): Width of one column of text
+        stats (FrameStats): Collects the time spent rendering text, if set
 
     Note:
         A different class from the pygame font class was created to store
         the size as well as the pygame font class.
 
     """
+    stats = None
+
     def __init__(self, font_location, size):
         self.font = pygame.font.Font(font_location, int(size))
         self.size = size
+        self._location = font_location
+        # Compared by advance, sizes include overhang that differs between glyphs of monospace fonts
+        advances = [metrics[4] if metrics else None for metrics in self.font.metrics('iWO')]
+        self.advance = advances[2] or self.font.size('O')[0]
+        self.monospace = advances[0] is not None and advances[0] == advances[1] == advances[2]
+        self._advances = {}
+
+    def reload(self):
+        """Loads the font again, pygame fonts can't be used once the font module was quit."""
+        self.font = pygame.font.Font(self._location, int(self.size))
+
+    def render(self, text, antialiasing, col, background=None):
+        """Renders text to a new surface, timing it if stats are being collected."""
+        stats = Font.stats
+        if stats is None:
+            return self.font.render(text, antialiasing, col, background)
+        start = perf_counter()
+        surface = self.font.render(text, antialiasing, col, background)
+        stats.add('render', perf_counter() - start)
+        stats.add('renders', 1)
+        return surface
+
+    def width(self, text):
+        """Returns the width of text from cached glyph advances, without kerning."""
+        if self.monospace:
+            return len(text) * self.advance
+        advances = self._advances
+        width = 0
+        for char in text:
+            advance = advances.get(char)
+            if advance is None:
+                advance = advances[char] = self.font.size(char)[0]
+            width += advance
+        return width
+
+
+class Theme(object):
+    """Theme class maps the colours text and backgrounds are written in to the
+    colours they are shown in, for the whole window.
+
+    Attributes:
+        colours (dict): The colour shown for each written colour that is changed
+        background (int tuple): Shown colour of the default background, which
+            the edges of antialiased palette text are blended with
+        palette (bool): Whether text is rendered to 8 bit palette surfaces
+        version (int): Counts up every time the theme changes
+
+    Note:
+        With palette text every glyph and text surface is rasterised once, as
+        an 8 bit mask of how much of each pixel the text covers, and is shown
+        in a colour by giving it a palette that runs from the background to
+        that colour. Changing the theme then only changes palettes. Without
+        palette text, text is rendered again in its new colour when next drawn.
+
+    """
+    colours = {}
+    background = (0, 0, 0)
+    palette = False
+    version = 0
+    _palettes = {}
+
+    @classmethod
+    def shown(cls, col):
+        """Returns the colour that a colour is shown in."""
+        if not cls.colours:
+            return col
+        return cls.colours.get(tuple(col), col)
+
+    @classmethod
+    def set(cls, colours, background):
+        """Changes the theme and recolours the text that has already been rendered.
+
+        Args:
+            colours (dict): The colour to show for each colour that is changed
+            background (int tuple): The default background colour, as written
+
+        """
+        cls.colours = dict((tuple(k), tuple(v)) for k, v in colours.items())
+        cls.background = cls.shown(tuple(background))
+        cls.version += 1
+        cls._palettes = {}
+        # Glyph atlases bring themselves up to date when next drawn
+        cache = CharacterString.cache
+        if cls.palette:
+            for cs, surface in cache.items():
+                surface.set_palette(cls.text_palette(cs.col, cs.antialiasing))
+        else:
+            cache.clear()
+
+    @classmethod
+    def text_palette(cls, col, antialiasing):
+        """Returns the palette that shows a text mask in a colour.
+
+        Args:
+            col (int tuple): The colour the text is written in
+            antialiasing (bool): Whether the mask is antialiased, when its
+                pixels are 0 to 255 for how much they are covered, otherwise
+                they are 0 or 1
+
+        """
+        key = (tuple(col), bool(antialiasing))
+        palette = cls._palettes.get(key)
+        if palette is None:
+            fg = cls.shown(key[0])
+            bg = cls.background
+            if antialiasing:
+                palette = [tuple(b + (f - b) * i // 255 for f, b in zip(fg, bg)) for i in range(256)]
+            else:
+                palette = [tuple(bg[:3]), tuple(fg[:3])]
+            palette = cls._palettes[key] = palette
+        return palette
+
+
+class GlyphMask(object):
+    """GlyphMask class rasterises each glyph of a font once onto an 8 bit
+    surface, where each pixel holds how much of it the glyph covers.
+
+    Args:
+        f (Font): Font to rasterise glyphs with
+        antialiasing (bool): Whether glyphs are antialiased
+
+    Attributes:
+        surface (pygame Surface): Surface holding every rasterised glyph
+        rects (dict): Area of each glyph on the surface, keyed by character
+        glyphs (int): How many glyphs have been rasterised
+
+    Note:
+        Masks are shared through GlyphMask.get. In palette mode every
+        GlyphAtlas of the font is a copy of the mask with its own palette, so
+        text in a new colour costs a copy instead of rasterising its glyphs.
+
+    """
+    _masks = {}
+
+    def __init__(self, f, antialiasing=False):
+        self.f = f
+        self.antialiasing = antialiasing
+        self.rects = {}
+        self.glyphs = 0
+        self._next_x = 0
+        # Glyphs rendered white on black all have this palette, so blitting
+        # them onto the mask copies their pixel values unchanged
+        self._palette = f.font.render('O', antialiasing, (255, 255, 255), (0, 0, 0)).get_palette()
+        self.surface = self._new_surface((f.advance * 64, f.font.get_height()))
+
+    @classmethod
+    def get(cls, f, antialiasing=False):
+        key = (f, bool(antialiasing))
+        mask = cls._masks.get(key)
+        if mask is None:
+            mask = cls._masks[key] = GlyphMask(f, antialiasing)
+        return mask
+
+    def _new_surface(self, size):
+        surface = pygame.Surface(size, 0, 8)
+        surface.set_palette(self._palette)
+        surface.set_colorkey(0)
+        return surface
+
+    def add(self, char):
+        """Rasterises a glyph onto the mask, returns its area."""
+        try:
+            glyph = self.f.render(char, self.antialiasing, (255, 255, 255), (0, 0, 0))
+        except pygame.error:
+            rect = self.rects[char] = pygame.Rect(self._next_x, 0, 0, 0)
+            return rect
+        w, h = glyph.get_size()
+        width, height = self.surface.get_size()
+        if self._next_x + w > width or h > height:
+            grown = self._new_surface((max(width * 2, self._next_x + w), max(height, h)))
+            grown.blit(self.surface, (0, 0))
+            self.surface = grown
+        glyph.set_palette(self._palette)
+        self.surface.blit(glyph, (self._next_x, 0))
+        rect = self.rects[char] = pygame.Rect(self._next_x, 0, w, h)
+        self._next_x += w
+        self.glyphs += 1
+        return rect
+
+
+class GlyphAtlas(object):
+    """GlyphAtlas class rasterises each glyph of a font once, in a single
+    colour, onto a shared surface that text is blitted from.
+
+    Args:
+        f (Font): Font to rasterise glyphs with
+        col (int tuple): The colour of the glyphs
+        antialiasing (bool): Whether glyphs are antialiased
+
+    Attributes:
+        surface (pygame Surface): Surface holding every rasterised glyph
+        rects (dict): Area of each glyph on the surface, keyed by character
+
+    Note:
+        Atlases should be shared through GlyphAtlas.get, which keeps at most
+        MAX_ATLASES of them and evicts the least recently used, for example
+        when text is written in a lot of different colours. Glyphs are shown
+        in the colour the Theme shows col in, in palette mode the atlas is a
+        copy of the font's GlyphMask with a palette for that colour.
+
+    """
+    MAX_ATLASES = 32
+    _atlases = OrderedDict()
+
+    def __init__(self, f, col, antialiasing=False, palette=False):
+        self.f = f
+        self.col = col
+        self.antialiasing = antialiasing
+        self._mask = GlyphMask.get(f, antialiasing) if palette else None
+        self._glyphs = None
+        self._apply_theme()
+
+    @classmethod
+    def get(cls, f, col, antialiasing=False):
+        key = (f, tuple(col), bool(antialiasing), Theme.palette)
+        atlas = cls._atlases.get(key)
+        if atlas is None:
+            atlas = cls._atlases[key] = GlyphAtlas(f, col, antialiasing, Theme.palette)
+            if len(cls._atlases) > cls.MAX_ATLASES:
+                cls._atlases.popitem(last=False)
+        else:
+            cls._atlases.move_to_end(key)
+        return atlas
+
+    def _apply_theme(self):
+        # Shows the glyphs in the colour the current theme shows col in
+        self._version = Theme.version
+        self.shown = Theme.shown(self.col)
+        if self._mask is not None:
+            if self._glyphs is None:
+                self._copy_mask()
+            self.surface.set_palette(Theme.text_palette(self.col, self.antialiasing))
+        else:
+            self.rects = {}
+            self._next_x = 0
+            self.surface = pygame.Surface((self.f.advance * 64, self.f.font.get_height()), SRCALPHA)
+
+    def _copy_mask(self):
+        mask = self._mask
+        self.surface = mask.surface.copy()
+        self.surface.set_palette(Theme.text_palette(self.col, self.antialiasing))
+        self.rects = mask.rects
+        self._glyphs = mask.glyphs
+
+    def _add(self, char):
+        if self._mask is not None:
+            return self._mask.add(char)
+        try:
+            glyph = self.f.render(char, self.antialiasing, self.shown)
+        except pygame.error:
+            # Glyphs without any width, such as a soft hyphen, draw nothing
+            rect = self.rects[char] = pygame.Rect(self._next_x, 0, 0, 0)
+            return rect
+        w, h = glyph.get_size()
+        width, height = self.surface.get_size()
+        if self._next_x + w > width or h > height:
+            # Grow the atlas, glyphs copy exactly onto a fully transparent surface
+            grown = pygame.Surface((max(width * 2, self._next_x + w), max(height, h)), SRCALPHA)
+            grown.blit(self.surface, (0, 0))
+            self.surface = grown
+        self.surface.blit(glyph, (self._next_x, 0))
+        rect = self.rects[char] = pygame.Rect(self._next_x, 0, w, h)
+        self._next_x += w
+        return rect
+
+    def add(self, text):
+        """Rasterises any glyphs in text that are not in the atlas yet."""
+        if self._version != Theme.version:
+            self._apply_theme()
+        for char in set(text):
+            if char not in self.rects:
+                self._add(char)
+
+    def blits(self, text, x, y):
+        """Returns a blit sequence that draws text at (x, y), one glyph per column."""
+        if self._version != Theme.version:
+            self._apply_theme()
+        rects = self.rects
+        for char in text:
+            if char not in rects:
+                self._add(char)
+        if self._mask is not None and self._glyphs != self._mask.glyphs:
+            # Glyphs were added to the mask since it was copied
+            self._copy_mask()
+        surface = self.surface
+        advance = self.f.advance
+        return [(surface, (x + i * advance, y), rects[c]) for i, c in enumerate(text)]
+
+
+class SurfaceCache(object):
+    """SurfaceCache class keeps rendered text surfaces up to a budget of bytes,
+    dropping the least recently used surfaces once the budget is exceeded.
+
+    Args:
+        budget (int): The most bytes of surfaces to keep
+
+    Attributes:
+        budget (int): The most bytes of surfaces to keep
+        size (int): Bytes of surfaces currently kept
+
+    """
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self._surfaces = OrderedDict()
+
+    def get(self, key):
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self._surfaces.move_to_end(key)
+        return surface
+
+    def put(self, key, surface):
+        self.discard(key)
+        self._surfaces[key] = surface
+        self.size += surface.get_pitch() * surface.get_height()
+        while self.size > self.budget and len(self._surfaces) > 1:
+            _, evicted = self._surfaces.popitem(last=False)
+            self.size -= evicted.get_pitch() * evicted.get_height()
+
+    def items(self):
+        return list(self._surfaces.items())
+
+    def clear(self):
+        self._surfaces.clear()
+        self.size = 0
+
+    def discard(self, key):
+        surface = self._surfaces.pop(key, None)
+        if surface is not None:
+            self.size -= surface.get_pitch() * surface.get_height()
 
 
 class CharacterString(object):
@@ -52,7 +393,8 @@ class CharacterString(object):
         col (int tuple): The colour of the text
 
     Attributes:
-        txt_surface (pygame Surface): Surface to be rendered by window class
+        txt_surface (pygame Surface): Surface to be rendered by window class,
+            None when the text is drawn from a glyph atlas
         text (str): Render-able text
         f (Font): Font to use with text
         pos (int tuple): The position in which to render the text at
@@ -60,21 +402,74 @@ class CharacterString(object):
 
     Note:
         This class not only stores the string, but also the position font and
-        colour. Furthermore allowing these values to be dynamicaly changed
+        colour. Furthermore allowing these values to be dynamicaly changed.
+        Text in a monospace font is not rendered as a whole, instead each
+        glyph is rasterised once into a GlyphAtlas and blitted from there.
+        Other text is only rendered when it is first drawn, and the surface
+        is kept in the shared CharacterString.cache, so strings that are not
+        being drawn don't hold on to surfaces.
 
     """
+    __slots__ = ('x', 'y', 'col', 'f', 'text', 'antialiasing', '_atlas')
+
+    cache = SurfaceCache(32 * 1024 * 1024)
+
     def __init__(self, text, f, pos, col=(255, 255, 255), antialiasing=False):
-        self.txt_surface = None
+        self._atlas = None
         self.x = pos[0]
         self.y = pos[1]
         self.col = col
         self.f = f
         self.text = text
         self.antialiasing = antialiasing
-        self.render()
+
+    @property
+    def txt_surface(self):
+        if self.f.monospace:
+            return None
+        surface = CharacterString.cache.get(self)
+        if surface is None:
+            if Theme.palette:
+                # A mask of the text, shown in its colour by the palette
+                surface = self.f.render(str(self.text), self.antialiasing, (255, 255, 255), (0, 0, 0))
+                surface.set_colorkey(0)
+                surface.set_palette(Theme.text_palette(self.col, self.antialiasing))
+            else:
+                surface = self.f.render(str(self.text), self.antialiasing, Theme.shown(self.col))
+            CharacterString.cache.put(self, surface)
+        return surface
 
     def render(self):
-        self.txt_surface = self.f.font.render(str(self.text), self.antialiasing, self.col)
+        """Rasterises the text now, after the text, font or colour has changed."""
+        self.release()
+        if self.f.monospace:
+            self._atlas = GlyphAtlas.get(self.f, self.col, self.antialiasing)
+            self._atlas.add(str(self.text))
+        else:
+            self._atlas = None
+            self.txt_surface
+
+    def release(self):
+        """Drops the rendered surface, it is rendered again when next drawn."""
+        self._atlas = None
+        CharacterString.cache.discard(self)
+
+    def blits(self, y=None, start=0, stop=None, x=None):
+        """Returns a blit sequence that draws the text, or the characters from
+        start to stop of it, at (x, y) if given."""
+        x = self.x if x is None else x
+        y = self.y if y is None else y
+        text = str(self.text)
+        if self.f.monospace:
+            if self._atlas is None:
+                self._atlas = GlyphAtlas.get(self.f, self.col, self.antialiasing)
+            return self._atlas.blits(text[start:stop], x, y)
+        surface = self.txt_surface
+        if start == 0 and (stop is None or stop >= len(text)):
+            return [(surface, (x, y))]
+        area = pygame.Rect(self.f.width(text[:start]), 0, self.f.width(text[start:stop]),
+                           surface.get_height())
+        return [(surface, (x, y), area)]
 
     def __str__(self):
         return self.text
@@ -95,125 +490,250 @@ class CharacterString(object):
             raise ValueError('Cannot multiply by ' + str(type(other)) + '.')
 
 
-class Display(object):
-
-    SHIFT_VARIATIONS = {'`': '~',
-                        '1': '!',
-                        '2': '@',
-                        '3': '#',
-                        '4': '$',
-                        '5': '%',
-                        '6': '^',
-                        '7': '&',
-                        '8': '*',
-                        '9': '(',
-                        '0': ')',
-                        '-': '_',
-                        '=': '+',
-                        '[': '{',
-                        ']': '}',
-                        '\\': '|',
-                        ';': ':',
-                        '\'': '"',
-                        ',': '<',
-                        '.': '>',
-                        '/': '?'
-                        }
+# A key press with its pygame key code, modifier flags and the text it types
+KeyEvent = namedtuple('KeyEvent', ['key', 'mod', 'unicode'])
+
+
+class Canvas(object):
+    """Canvas class is the drawing interface shared by a display and its regions.
+
+    Attributes:
+        stats (FrameStats): Collects the time spent filling and blitting, if set
+        offset (int tuple): Position of the canvas in the window
+
+    Note:
+        Coordinates given to a canvas are relative to its top left corner,
+        rects returned by fill are in window coordinates so they can be passed
+        on to Display.update.
+
+    """
+    stats = None
+    offset = (0, 0)
+
+    def _surface(self):
+        raise NotImplementedError
+
+    @property
+    def rect(self):
+        """pygame Rect: Area of the window the canvas draws to."""
+        return pygame.Rect(self.offset, (self.width, self.height))
+
+    def blits(self, sequence):
+        stats = Canvas.stats
+        if stats is None:
+            self._surface().blits(sequence, doreturn=False)
+            return
+        start = perf_counter()
+        self._surface().blits(sequence, doreturn=False)
+        stats.add('blit', perf_counter() - start)
+        stats.add('blits', len(sequence))
+
+    def fill(self, bg, rect=None):
+        if Theme.colours:
+            bg = Theme.shown(bg)
+        stats = Canvas.stats
+        if stats is None:
+            return self._surface().fill(bg, rect).move(self.offset)
+        start = perf_counter()
+        rect = self._surface().fill(bg, rect).move(self.offset)
+        stats.add('fill', perf_counter() - start)
+        stats.add('fills', 1)
+        return rect
+
+    def scroll(self, dy):
+        self._surface().scroll(0, dy)
+
+
+class Region(Canvas):
+    """Region class draws to a rectangle of a display's window.
+
+    Args:
+        display (Display): The display whose window is drawn to
+        rect (int tuple): The (x, y, width, height) of the region in the window
+
+    Attributes:
+        display (Display): The display whose window is drawn to
+        width (int): Width of the region
+        height (int): Height of the region
+        damaged (bool): Whether the whole region has to be redrawn
+
+    Note:
+        Drawing is clipped to the region, so scrolling a region leaves the rest
+        of the window alone. The parts of the region outside of the window are
+        cut off.
+
+    """
+    def __init__(self, display, rect):
+        self.display = display
+        self._rect = pygame.Rect(rect)
+        self.offset = self._rect.topleft
+        self._source = None
+        self._surf = None
+        self._damaged = True
+
+    def _surface(self):
+        # Resizing the window changes the size of the window surface, or
+        # replaces it, so the subsurface has to be made again
+        source = (self.display._surf, self.display.resizes)
+        if source != self._source:
+            self._source = source
+            clipped = self._rect.clip(source[0].get_rect())
+            if clipped.width and clipped.height:
+                self._surf = source[0].subsurface(clipped)
+            else:
+                # Entirely outside of the window, drawing goes nowhere
+                self._surf = pygame.Surface((0, 0))
+            self._damaged = True
+        return self._surf
+
+    @property
+    def width(self):
+        return self._surface().get_width()
+
+    @property
+    def height(self):
+        return self._surface().get_height()
+
+    @property
+    def damaged(self):
+        self._surface()
+        return self._damaged or self.display.damaged
+
+    @damaged.setter
+    def damaged(self, value):
+        self._damaged = value
+
+
+class Display(Canvas):
+
+    # Posted to wake a display that is waiting for input
+    WAKE = pygame.event.custom_type()
+    # Rows scrolled by each step of the mouse wheel
+    WHEEL_ROWS = 3
 
     def __init__(self, title, fps, icon_loc, size=(500, 300), min_size=(None, None),
                                                               max_size=(None, None),
-                                                              resizeable=False, beep_sound=None):
-        pygame.init()
+                                                              resizeable=False, beep_sound=None,
+                                                              headless=False, key_queue_size=1024):
+        # Headless displays draw to SDL's dummy video driver, so nothing is shown
+        # and no audio device is needed, but rendering is exactly the same.
+        self.headless = headless
+        # The driver is only chosen for this init, so later windows and child
+        # processes still get the driver they would have had
+        dummy = headless and not pygame.display.get_init()
+        if dummy:
+            driver = os.environ.get('SDL_VIDEODRIVER')
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        # Only the subsystems used to draw are started, the mixer is slow to
+        # start and can stall without an audio device, so it waits for a beep
+        try:
+            pygame.display.init()
+        finally:
+            if dummy:
+                if driver is None:
+                    del os.environ['SDL_VIDEODRIVER']
+                else:
+                    os.environ['SDL_VIDEODRIVER'] = driver
         pygame.font.init()
-        pygame.mixer.init()
 
-        if icon_loc is not None:
+        if icon_loc is not None and not headless:
             pygame.display.set_icon(pygame.image.load(icon_loc))
 
         self.width = size[0]
         self.height = size[1]
+        # Counts window resizes, so regions know to clip themselves again
+        self.resizes = 0
 
         self._surf = pygame.display.set_mode((self.width, self.height), HWSURFACE | DOUBLEBUF)
         pygame.display.set_caption(title)
+        # Set when the whole surface has to be redrawn, such as after a resize
+        self.damaged = True
         self.min_size = min_size
         self.max_size = max_size
 
         self.resizeable = resizeable
 
         self._total_ms = 0
+        # Seconds the last step spent sleeping for the fps limit or waiting for input
+        self.waited = 0
+        # Area covered by the overlay and what was drawn under it
+        self._overlay = None
         self._clock = pygame.time.Clock()
         self._FPS = fps
 
-        # All keys that have been pressed before return
-        self._sustained_keys = ""
-        # Flag to mark when to remove sk's as return pressed
-        self._sk_flag = False
-
-        # Event variable for key down
-        self._key_down = None
-        # Event variable for return pressed
-        self._return_down = False
-        # Event variable for backspace pressed\
-        self._back_down = False
-
-        # Add custom code to find initial caps state here...
-        self._caps = False
-
-        if beep_sound:
-            self.beep_sound = pygame.mixer.Sound(beep_sound)
-
-
-    def display_text(self, cs):
-        self._surf.blit(cs.txt_surface, (cs.x, cs.y))
-
-    def step(self, bg):
-        self._total_ms += self._clock.tick(self._FPS)
-
-        self._surf.fill(bg)
-
-        # Reset key down variables at start of step
-        self._key_down = None
-        self._return_down = False
-        self._back_down = False
-
-        # Check if sk flag triggered and reset sk and sk flag
-        if self._sk_flag is True:
-            self._sustained_keys = ""
-            self._sk_flag = False
-
-        # Key presses
-        key_state = pygame.key.get_pressed()
-        upper = False
-        if key_state[K_LSHIFT] or self._caps:
-            upper = True
-
-        for event in pygame.event.get():
+        # Key presses waiting to be read, every press between frames is kept.
+        # Once key_queue_size presses are waiting new ones are dropped, so what
+        # was typed first is never lost, and counted in dropped_keys
+        self._keys = deque()
+        self._key_queue_size = key_queue_size
+        self.dropped_keys = 0
+        # Scrolling asked for by PageUp, PageDown and the mouse wheel since the
+        # last get_scrolls, as (mouse position or None, rows, pages)
+        self._scrolls = []
+
+        # Loaded by the first beep
+        self.beep_sound = None
+        self._beep_file = None if headless else beep_sound
+
+
+    def _surface(self):
+        return self._surf
+
+    def display_text(self, cs, y=None):
+        self._surf.blits(cs.blits(y), doreturn=False)
+
+    def draw_overlay(self, lines, f, fg, bg):
+        # Draws lines of text in a box at the top right, over whatever is drawn
+        # there until clear_overlay puts it back, returns the rect of the box
+        surfaces = [f.font.render(line, False, fg, bg) for line in lines]
+        width = max(surface.get_width() for surface in surfaces) + 4
+        height = sum(surface.get_height() for surface in surfaces) + 4
+        rect = pygame.Rect(self.width - width, 0, width, height).clip(self._surf.get_rect())
+        self._overlay = (rect, self._surf.subsurface(rect).copy())
+        self._surf.fill(bg, rect)
+        y = rect.y + 2
+        for surface in surfaces:
+            self._surf.blit(surface, (rect.x + 2, y))
+            y += surface.get_height()
+        return rect
+
+    def clear_overlay(self):
+        # Puts back what was drawn under the overlay, returns its rect or None
+        if self._overlay is None:
+            return None
+        rect, under = self._overlay
+        self._overlay = None
+        self._surf.blit(under, rect)
+        return rect
+
+    def step(self, wait=True, idle=None):
+        # Without wait the frame time is still measured but the fps limit is not slept out
+        start = perf_counter()
+        self._total_ms += self._clock.tick(self._FPS if wait else 0)
+        self.waited = perf_counter() - start
+
+        events = pygame.event.get()
+        if not events and idle is not None:
+            # Nothing to draw, so sleep until an event arrives or for at most
+            # idle ms, 0 waiting for as long as it takes
+            start = perf_counter()
+            events = [pygame.event.wait(idle)] + pygame.event.get()
+            self._total_ms += self._clock.tick()
+            self.waited += perf_counter() - start
+
+        for event in events:
             if event.type == QUIT:
                 self.quit()
 
             if event.type == KEYDOWN:
-                if event.key == K_RETURN:
-                    self._return_down = True
-                elif event.key == K_BACKSPACE:
-                    self._sustained_keys = self._sustained_keys[:-1]
-                    self._back_down = True
-                elif event.key == K_CAPSLOCK:
-                    if self._caps:
-                        self._caps = False
-                        upper = False
-                    else:
-                        self._caps = True
-                        upper = True
-                elif event.key != K_LSHIFT:
-                    if upper:
-                        try:
-                            if Display.SHIFT_VARIATIONS[chr(event.key)]:
-                                self._key_down = Display.SHIFT_VARIATIONS[chr(event.key)]
-                        except KeyError:
-                            self._key_down = chr(event.key).upper()
-                    else:
-                        self._key_down = chr(event.key)
-                    self._sustained_keys += self._key_down
+                # The unicode text already has shift and caps lock applied
+                self.push_key(KeyEvent(event.key, event.mod, event.unicode))
+                if event.key == K_PAGEUP or event.key == K_PAGEDOWN:
+                    self._scrolls.append((None, 0, -1 if event.key == K_PAGEUP else 1))
+
+            if event.type == MOUSEWHEEL:
+                # Wheel up is a positive y and scrolls back to earlier rows
+                self._scrolls.append((pygame.mouse.get_pos(), -event.y * self.WHEEL_ROWS, 0))
 
             # Handle resizing and min window size
             if event.type == VIDEORESIZE and self.resizeable:
@@ -229,31 +749,57 @@ class Display(object):
                     if self.height > self.max_size[1]:
                         self.height = self.max_size[1]
                 self._surf = pygame.display.set_mode((self.width, self.height), HWSURFACE | DOUBLEBUF | RESIZABLE)
+                self.resizes += 1
+                self.damaged = True
             #pygame.display.flip()
 
-    def get_key(self):
-        # Return key pressed on this frame, return None if no key pressed
-        self._sustained_keys = ''
-        return self._key_down
-
-    def get_line(self):
-        # Return all sk, return pressed event and key pressed this frame
-        return [self._sustained_keys, self._return_down, self._key_down, self._back_down]
+    @staticmethod
+    def wake():
+        # Ends a wait for input in step, safe to call from any thread
+        pygame.event.post(pygame.event.Event(Display.WAKE))
 
-    def reset_get_line(self):
-        # Used after get_line method to reset sk
-        self._sk_flag = True
+    def get_key(self):
+        # Oldest key press that has not been read, None if there are none
+        return self._keys.popleft() if self._keys else None
+
+    def get_scrolls(self):
+        # Takes the scrolling asked for since the last call
+        scrolls, self._scrolls = self._scrolls, []
+        return scrolls
+
+    def push_key(self, event):
+        # Queues a KeyEvent as if its key had been pressed, dropped if the queue is full
+        if len(self._keys) < self._key_queue_size:
+            self._keys.append(event)
+        else:
+            self.dropped_keys += 1
 
     # PLEASE FIX
     def get_run_time(self):
         return self._total_ms
 
     def beep(self):
-        self.beep_sound.play()
+        if self.beep_sound is None and self._beep_file:
+            if not pygame.mixer.get_init():
+                pygame.mixer.init()
+            self.beep_sound = pygame.mixer.Sound(self._beep_file)
+            self._beep_file = None
+        if self.beep_sound is not None:
+            self.beep_sound.play()
+
+    def snapshot(self, as_array=False):
+        # Copy of the drawn frame, RGB bytes row by row or a (height, width, 3) NumPy array
+        if as_array:
+            return pygame.surfarray.array3d(self._surf).swapaxes(0, 1)
+        return pygame.image.tobytes(self._surf, 'RGB')
 
     @staticmethod
-    def update():
-        pygame.display.update()
+    def update(rects=None):
+        # Only push the given rects to the window, or the whole window if None
+        if rects is None:
+            pygame.display.update()
+        elif rects:
+            pygame.display.update(rects)
 
     @staticmethod
     def quit(full_quit=True):
@@ -0,0 +1,49 @@
+import os
+import re
+
+import pytest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame
+
+from pysole.console import Console
+from pysole.search import literals
+
+
+def _console(**config):
+    font = os.path.join(os.path.dirname(pygame.__file__), pygame.font.get_default_font())
+    config.update(font=font, headless=True, fps=0, buffered=True, auto_present=False)
+    return Console(config)
+
+
+@pytest.mark.parametrize('pattern', [r'\x45RROR', r'\105RROR', r'\U00000045RROR',
+                                     r'\N{LATIN CAPITAL LETTER E}RROR', r'(E)RR\1'])
+def test_escapes_that_are_not_worked_out_do_not_narrow(pattern):
+    assert literals(pattern) == []
+
+
+def test_plain_escapes_are_literal():
+    assert literals(r'a\.b\tc') == ['a.b\tc']
+    assert literals(r'foo\dbar') == ['foo', 'bar']
+
+
+@pytest.mark.parametrize('pattern', [r'\x45RROR', r'\105RROR', r'(?x) ERR OR', r'ERR OR'])
+def test_find_matches_every_line_that_matches(pattern):
+    console = _console()
+    for i in range(20):
+        console.write_line('ERROR foo' if i == 10 else 'line ' + str(i))
+    flags = re.VERBOSE if pattern == 'ERR OR' else 0
+    assert console.find(pattern, flags) is not None
+
+
+def test_find_after_lines_were_dropped_between_searches():
+    console = _console(line_cutoff=200)
+    for i in range(100):
+        console.write_line('line ' + str(i))
+    assert console.find('line 5') is not None
+    for i in range(1000):
+        console.write_line('more ' + str(i))
+    console.write_line('NEEDLE here')
+    assert console.find('NEEDLE') is not None